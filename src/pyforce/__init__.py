@@ -4,11 +4,15 @@ from xmlclient import _tPartnerNS, _tSObjectNS, _tSoapNS, SoapFaultError,\
     SessionTimeoutError, DEFAULT_SERVER_URL
 from xmlclient import Client as XMLClient
 from pyforce import Client as PythonClient
+from asyncclient import AsyncClient
+from describecache import FileDescribeCache, SQLiteDescribeCache,\
+    TypeDescriptionCache
 
 __all__ = (
     'XMLClient', '_tPartnerNS', '_tSObjectNS', '_tSoapNS', 'tests',
     'SoapFaultError', 'SessionTimeoutError', 'PythonClient',
-    'DEFAULT_SERVER_URL'
+    'DEFAULT_SERVER_URL', 'AsyncClient', 'FileDescribeCache',
+    'SQLiteDescribeCache', 'TypeDescriptionCache'
 )
 
 
@@ -0,0 +1,114 @@
+'''Concurrent counterpart of the XML and Python clients'''
+import logging
+from executor import Executor
+from pyforce import Client as PythonClient
+
+DEFAULT_CONCURRENCY = 16
+
+_logger = logging.getLogger('pyforce.{0}'.format(__name__))
+
+
+class AsyncClient(object):
+    """
+    Runs API calls in the background, each call returns a Future.
+
+    The calls are delegated to a regular client, so requests are serialized
+    by the usual SoapEnvelope classes and, for the default PythonClient,
+    results are marshalled the same way as synchronous calls. At most
+    maxConcurrency calls are in flight at once; the wrapped client gets a
+    connection pool of the same size so every running call has a socket.
+
+        >>> from pyforce.executor import gather
+        >>> svc = AsyncClient()
+        >>> svc.login('username', 'passwordTOKEN')
+        >>> futures = [svc.retrieve('Id, Name', 'Account', [id]) for id in ids]
+        >>> accounts = gather(futures)
+
+    Pass an existing logged in client (XMLClient or PythonClient) as client
+    to share its session, the client should have been created with at least
+    maxConcurrency maxConnections.
+    """
+    def __init__(self, serverUrl=None, cacheTypeDescriptions=False,
+                 maxConcurrency=DEFAULT_CONCURRENCY, client=None):
+        self.__ownsClient = client is None
+        if client is None:
+            client = PythonClient(serverUrl, cacheTypeDescriptions,
+                                  maxConnections=maxConcurrency)
+        self.client = client
+        self.maxConcurrency = maxConcurrency
+        self.__executor = Executor(maxConcurrency)
+
+    def __submit(self, name, *args, **kw):
+        _logger.debug('submitting {0}'.format(name))
+        return self.__executor.submit(getattr(self.client, name), *args, **kw)
+
+    # login and logout block, everything else needs the session they set up
+    def login(self, username, password):
+        return self.client.login(username, password)
+
+    def useSession(self, sessionId, serverUrl):
+        return self.client.useSession(sessionId, serverUrl)
+
+    def logout(self):
+        return self.client.logout()
+
+    def close(self):
+        """
+        Stop the worker threads once all submitted calls have finished, then
+        close the wrapped client unless it was passed in.
+        """
+        self.__executor.shutdown()
+        if self.__ownsClient:
+            self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def query(self, *args, **kw):
+        return self.__submit('query', *args, **kw)
+
+    def queryMore(self, queryLocator):
+        return self.__submit('queryMore', queryLocator)
+
+    # these iterate in the calling thread, with their own prefetching threads
+    def query_iter(self, soql, prefetch=1):
+        return self.client.query_iter(soql, prefetch)
+
+    def query_partitioned(self, soql, partitions=4, field='Id', prefetch=1):
+        return self.client.query_partitioned(soql, partitions, field, prefetch)
+
+    def query_columnar(self, soql, prefetch=1, partitions=1):
+        return self.__submit('query_columnar', soql, prefetch, partitions)
+
+    def search(self, sosl):
+        return self.__submit('search', sosl)
+
+    def retrieve(self, fields, sObjectType, ids):
+        return self.__submit('retrieve', fields, sObjectType, ids)
+
+    def create(self, sObjects):
+        return self.__submit('create', sObjects)
+
+    def update(self, sObjects):
+        return self.__submit('update', sObjects)
+
+    def upsert(self, externalIdName, sObjects):
+        return self.__submit('upsert', externalIdName, sObjects)
+
+    def delete(self, ids):
+        return self.__submit('delete', ids)
+
+    def describeSObjects(self, sObjectTypes):
+        return self.__submit('describeSObjects', sObjectTypes)
+
+    def describeGlobal(self):
+        return self.__submit('describeGlobal')
+
+    def getUpdated(self, sObjectType, start, end):
+        return self.__submit('getUpdated', sObjectType, start, end)
+
+    def getDeleted(self, sObjectType, start, end):
+        return self.__submit('getDeleted', sObjectType, start, end)
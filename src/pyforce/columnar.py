@@ -0,0 +1,254 @@
+'''Query results held column by column, in compact arrays where possible'''
+import array
+import datetime
+from export import Column as _Path, selectColumns
+from marshall import doubletypes
+from pyforce import CompactQueryRecord, findKey
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# epoch milliseconds and integers need 64 bits, which the C long only has on
+# some platforms; doubles hold integers exactly up to 2 ** 53 elsewhere
+LONG_TYPECODE = array.array('l').itemsize >= 8 and 'l' or 'd'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+_epochOrdinal = EPOCH.toordinal()
+
+
+def _dateToDays(value):
+    return value.toordinal() - _epochOrdinal
+
+
+def _daysToDate(value):
+    return datetime.date.fromordinal(int(value) + _epochOrdinal)
+
+
+def _datetimeToMillis(value):
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + \
+        delta.microseconds // 1000
+
+
+def _millisToDatetime(value):
+    return EPOCH + datetime.timedelta(milliseconds=int(value))
+
+
+# kind -> (array typecode, encode, decode), for the kinds held in arrays
+_arrayKinds = {
+    'int': (LONG_TYPECODE, int, int),
+    'double': ('d', float, float),
+    'boolean': ('b', int, bool),
+    'date': (LONG_TYPECODE, _dateToDays, _daysToDate),
+    'datetime': (LONG_TYPECODE, _datetimeToMillis, _millisToDatetime),
+}
+
+# numpy views of the array kinds, by array typecode
+_numpyTypes = {
+    'int': {'l': 'i8', 'd': 'f8'},
+    'double': {'d': 'f8'},
+    'boolean': {'b': 'bool'},
+    'date': {'l': 'datetime64[D]'},
+    'datetime': {'l': 'datetime64[ms]'},
+}
+
+
+def fieldKind(fieldType):
+    """How values of a field of fieldType are held by a ColumnarRecordSet."""
+    if fieldType in doubletypes:
+        return 'double'
+    if fieldType in _arrayKinds or fieldType == 'picklist':
+        return fieldType
+    return 'object'
+
+
+def valueKind(value):
+    """The kind of a column holding value, when its field type is unknown."""
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, long)):
+        return 'int'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    return 'object'
+
+
+class ColumnValues(object):
+    """
+    The values of one column. Numbers, booleans, dates (as days since the
+    epoch) and datetimes (as UTC milliseconds since the epoch) are held in
+    an array.array, along with an array of null flags; picklist values share
+    one string object per distinct value; anything else is kept in a list.
+
+    The kind is set when the column is created or, if it is None, from the
+    first value that isn't None.
+    """
+    def __init__(self, name, kind=None):
+        self.name = name
+        self.kind = None
+        self.values = []
+        self.nulls = array.array('b')
+        self.__encode = self.__decode = None
+        self.__interned = None
+        if kind is not None:
+            self.setKind(kind)
+
+    def setKind(self, kind):
+        self.kind = kind
+        if kind in _arrayKinds:
+            typecode, self.__encode, self.__decode = _arrayKinds[kind]
+            # rows appended while the kind was unknown were all null
+            self.values = array.array(typecode, [0] * len(self.values))
+        elif kind == 'picklist':
+            self.__interned = dict()
+
+    @property
+    def typecode(self):
+        return isinstance(self.values, array.array) and \
+            self.values.typecode or None
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def append(self, value):
+        if value is None:
+            self.nulls.append(1)
+            if self.__encode is not None:
+                self.values.append(0)
+            else:
+                self.values.append(None)
+            return
+        if self.kind is None:
+            self.setKind(valueKind(value))
+        self.nulls.append(0)
+        if self.__encode is not None:
+            self.values.append(self.__encode(value))
+        elif self.__interned is not None:
+            self.values.append(self.__interned.setdefault(value, value))
+        else:
+            self.values.append(value)
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return None
+        if self.__decode is not None:
+            return self.__decode(self.values[i])
+        return self.values[i]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def numpy(self):
+        """
+        The column as a NumPy array. Array backed columns are viewed without
+        copying their values, as a masked array when some are null; such a
+        view must not outlive the column or see it grow.
+        """
+        if numpy is None:
+            raise ImportError('NumPy is needed for numpy()')
+        dtype = _numpyTypes.get(self.kind, {}).get(self.typecode)
+        if dtype is None:
+            if self.typecode is None:
+                return numpy.array(self.values, dtype=object)
+            # e.g. epoch milliseconds held as doubles, converted by a copy
+            data = numpy.array(self.values, dtype='i8')
+            dtype = _numpyTypes[self.kind]['l']
+        elif self.values:
+            data = numpy.frombuffer(self.values, dtype=self.typecode)
+        else:
+            data = numpy.array([], dtype=self.typecode)
+        data = data.view(dtype)
+        if 1 in self.nulls:
+            mask = numpy.frombuffer(self.nulls, dtype='bool')
+            return numpy.ma.masked_array(data, mask=mask)
+        return data
+
+
+class ColumnarRecordSet(object):
+    """
+    The records of a query stored column by column, in the order of the
+    select list: relationship fields like Account.Name get their own
+    column, child relationship subqueries a column of QueryRecordSets.
+
+    rs['Name'] is a column, rs.row(i) the dict of the values of a record.
+    describe, given an sObject type, returns its description, from which
+    the columns take their kind; otherwise the kind comes from the values.
+    """
+    def __init__(self, columns, describe=None):
+        self.__paths = columns
+        self.columns = [ColumnValues(c.name, c.child and 'object' or None)
+                        for c in columns]
+        self.__describe = describe
+        self.__described = set()
+        self.__byName = dict([(c.name.lower(), c) for c in self.columns])
+
+    def __len__(self):
+        return self.columns and len(self.columns[0]) or 0
+
+    def names(self):
+        return [c.name for c in self.columns]
+
+    def __getitem__(self, name):
+        return self.__byName[name.lower()]
+
+    def append(self, record):
+        for i, path in enumerate(self.__paths):
+            column = self.columns[i]
+            if column.kind is None and self.__describe is not None and \
+                    i not in self.__described:
+                self.__describeKind(i, path, column, record)
+            column.append(path.value(record))
+
+    # the kind of column from the description of the record holding its
+    # field, once there is one
+    def __describeKind(self, i, path, column, record):
+        if len(path.path) > 1:
+            record = _Path(None, path.path[:-1]).value(record)
+        if not isinstance(record, (dict, CompactQueryRecord)) or \
+                not record.get('type'):
+            return
+        self.__described.add(i)
+        if record['type'] == 'AggregateResult':  # can't be described
+            return
+        description = self.__describe(record['type'])
+        name = description and findKey(description.fields, path.path[-1])
+        if name is not None:
+            column.setKind(fieldKind(description.fields[name].type))
+
+    def row(self, i):
+        return dict([(c.name, c[i]) for c in self.columns])
+
+    def rows(self):
+        for i in xrange(len(self)):
+            yield self.row(i)
+
+    def numpy(self):
+        """A dict of the columns as NumPy arrays, see ColumnValues.numpy."""
+        return dict([(c.name, c.numpy()) for c in self.columns])
+
+
+def queryColumnar(client, soql, prefetch=1, partitions=1):
+    """
+    The records of soql as a ColumnarRecordSet, read page by page with
+    client, a Python client, so only a page of QueryRecords is held at once.
+    """
+    def describe(sObjectType):
+        return client.typeDescs.getMany(
+            [sObjectType], client.queryTypesDescriptions)[sObjectType]
+    result = ColumnarRecordSet(selectColumns(soql), describe)
+    if partitions > 1:
+        records = client.query_partitioned(soql, partitions, prefetch=prefetch)
+    else:
+        records = client.query_iter(soql, prefetch)
+    for record in records:
+        result.append(record)
+    return result
@@ -0,0 +1,352 @@
+'''Caches of describeSObjects results, in memory and across processes'''
+import cPickle as pickle
+import itertools
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from urlparse import urlparse
+from executor import Future
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_TYPES = 1000
+# of the marshalling plans and record classes made from the descriptions
+DEFAULT_MAX_DERIVED = 1000
+
+_logger = logging.getLogger('pyforce.{0}'.format(__name__))
+
+_unsafe = re.compile(r'[^\w.-]')
+
+
+def describeKey(serverUrl, sObjectType):
+    """
+    The cache key of an sObject type described through serverUrl, which
+    looks like https://na1.salesforce.com/services/Soap/u/20.0/00D300000000ABC
+
+    Descriptions depend on the org and on the API version, sObject names
+    are case insensitive.
+    """
+    path = [p for p in urlparse(serverUrl)[2].split('/') if p]
+    orgId = version = ''
+    if 'u' in path:
+        rest = path[path.index('u') + 1:]
+        if rest:
+            version = rest[0]
+        if len(rest) > 1:
+            orgId = rest[1]
+    return (orgId, version, sObjectType.lower())
+
+
+class DescribeCache(object):
+    """
+    Base class of the describe cache backends.
+
+    Entries older than ttl seconds are treated as missing, a ttl of None
+    keeps them forever. Backends store pickled SObjects, so only point them
+    at locations no one else can write to.
+    """
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            entry = self.load(key)
+        except Exception:
+            _logger.warning('Unreadable describe cache entry {0}'.format(key),
+                            exc_info=True)
+            return None
+        if entry is None:
+            return None
+        stored, sObject = entry
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            return None
+        return sObject
+
+    def set(self, key, sObject):
+        try:
+            self.store(key, (time.time(), sObject))
+        except Exception:
+            _logger.warning('Could not write describe cache entry {0}'.format(
+                key), exc_info=True)
+
+    # backends implement these, load returns None for a missing entry
+    def load(self, key):
+        raise NotImplementedError
+
+    def store(self, key, entry):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class FileDescribeCache(DescribeCache):
+    """
+    One pickle file per sObject type, under directory/orgId/version/.
+
+    Entries are written to a temporary file which is then renamed over the
+    old one, so readers in other processes never see a partial entry.
+    """
+    def __init__(self, directory, ttl=DEFAULT_TTL):
+        DescribeCache.__init__(self, ttl)
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory,
+                            *[_unsafe.sub('_', k) or '_' for k in key])
+
+    def load(self, key):
+        try:
+            f = open(self.path(key) + '.pickle', 'rb')
+        except IOError:
+            return None
+        try:
+            return pickle.load(f)
+        finally:
+            f.close()
+
+    def store(self, key, entry):
+        path = self.path(key) + '.pickle'
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # made by another process meanwhile
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            try:
+                os.rename(tmp, path)
+            except OSError:  # windows won't rename over an existing file
+                os.remove(path)
+                os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def clear(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(root, name))
+
+
+class SQLiteDescribeCache(DescribeCache):
+    """
+    Entries stored in a table of an SQLite database file.
+
+    Each operation opens its own connection, so the cache can be used from
+    several threads and processes at once; SQLite serializes the writes.
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL, timeout=30):
+        DescribeCache.__init__(self, ttl)
+        self.path = path
+        self.timeout = timeout
+        conn = self.connect()
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS describes ('
+                         'org TEXT, version TEXT, name TEXT, entry BLOB, '
+                         'PRIMARY KEY (org, version, name))')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def connect(self):
+        import sqlite3
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def load(self, key):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT entry FROM describes WHERE org = ? '
+                               'AND version = ? AND name = ?', key).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0]))
+
+    def store(self, key, entry):
+        import sqlite3
+        data = sqlite3.Binary(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+        conn = self.connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO describes VALUES (?, ?, ?, ?)',
+                         tuple(key) + (data,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM describes')
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class LRUDict(dict):
+    """
+    A dict of at most maxEntries items (None for no limit), dropping the
+    least recently used ones first. Only get, setdefault, item assignment
+    and clear keep track of the use of the items, which may happen in
+    several threads at once.
+    """
+    def __init__(self, maxEntries=DEFAULT_MAX_DERIVED):
+        dict.__init__(self)
+        self.maxEntries = maxEntries
+        self.__lock = threading.Lock()
+        self.__used = dict()  # key -> last used
+        self.__ticks = itertools.count()
+
+    def get(self, key, default=None):
+        value = dict.get(self, key, default)
+        if value is not default:
+            self.__used[key] = self.__ticks.next()
+        return value
+
+    def __setitem__(self, key, value):
+        self.__lock.acquire()
+        try:
+            self.__set(key, value)
+        finally:
+            self.__lock.release()
+
+    def setdefault(self, key, value=None):
+        self.__lock.acquire()
+        try:
+            if key in self:
+                value = dict.__getitem__(self, key)
+            self.__set(key, value)
+            return value
+        finally:
+            self.__lock.release()
+
+    def __set(self, key, value):
+        dict.__setitem__(self, key, value)
+        used = self.__used
+        used[key] = self.__ticks.next()
+        while self.maxEntries is not None and len(self) > self.maxEntries:
+            # a get racing with an eviction may leave a stale key in used
+            oldest = min(used, key=used.get)
+            del used[oldest]
+            dict.pop(self, oldest, None)
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            dict.clear(self)
+            self.__used.clear()
+        finally:
+            self.__lock.release()
+
+
+class TypeDescriptionCache(object):
+    """
+    In memory cache of the sObject descriptions used to marshall records.
+
+    Keeps at most maxEntries descriptions (None for no limit), dropping the
+    least recently used ones first, for at most ttl seconds each (None for
+    no limit). It can be shared by threads: when several of them need a
+    type that isn't cached, one loads it and the others wait for its result.
+    hits and misses count the types looked up.
+    """
+    def __init__(self, maxEntries=DEFAULT_MAX_TYPES, ttl=None):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__entries = dict()  # type -> [stored, sObject, last used]
+        self.__ticks = itertools.count()
+        self.__loading = {}  # type -> Future of its description
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, sObjectType):
+        return sObjectType in self.__entries
+
+    def clear(self):
+        self.__lock.acquire()
+        try:
+            self.__entries.clear()
+        finally:
+            self.__lock.release()
+
+    def getMany(self, sObjectTypes, load, refresh=False):
+        """
+        Return a dict of the descriptions of sObjectTypes.
+
+        Types that aren't cached, or all of them with refresh, are loaded in
+        a single load(types) call returning a dict of type -> description,
+        unless another thread is loading them already.
+        """
+        found = dict()
+        mine = dict()
+        theirs = dict()
+        self.__lock.acquire()
+        try:
+            now = time.time()
+            for t in set(sObjectTypes):
+                entry = self.__entries.get(t)
+                if (entry is not None and not refresh and
+                        (self.ttl is None or now - entry[0] <= self.ttl)):
+                    entry[2] = self.__ticks.next()
+                    found[t] = entry[1]
+                    self.hits += 1
+                    continue
+                if entry is not None:
+                    del self.__entries[t]
+                self.misses += 1
+                if t in self.__loading:
+                    theirs[t] = self.__loading[t]
+                else:
+                    mine[t] = self.__loading[t] = Future()
+        finally:
+            self.__lock.release()
+        if mine:
+            found.update(self.__load(mine, load))
+        for t, future in theirs.items():
+            found[t] = future.result()
+        return found
+
+    def __load(self, futures, load):
+        try:
+            loaded = load(futures.keys())
+        except BaseException:
+            excInfo = sys.exc_info()
+            self.__finish(futures)
+            for future in futures.values():
+                future.setException(excInfo)
+            raise excInfo[0], excInfo[1], excInfo[2]
+        self.__finish(futures, loaded)
+        for t, future in futures.items():
+            future.setResult(loaded.get(t))
+        return loaded
+
+    def __finish(self, futures, loaded=None):
+        self.__lock.acquire()
+        try:
+            now = time.time()
+            for t in futures:
+                del self.__loading[t]
+                if loaded and loaded.get(t) is not None:
+                    self.__entries[t] = [now, loaded[t], self.__ticks.next()]
+            while (self.maxEntries is not None and
+                   len(self.__entries) > self.maxEntries):
+                entries = self.__entries
+                del entries[min(entries, key=lambda t: entries[t][2])]
+        finally:
+            self.__lock.release()
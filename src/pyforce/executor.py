@@ -0,0 +1,231 @@
+'''Minimal futures and a bounded thread pool to run API calls concurrently'''
+import logging
+import sys
+import threading
+from Queue import Queue, Empty
+
+_logger = logging.getLogger('pyforce.{0}'.format(__name__))
+
+
+class Future(object):
+    """
+    The pending result of a call submitted to an Executor.
+
+    result() blocks until the call has finished, then returns its value or
+    re-raises the exception it raised, with the original traceback.
+    """
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__done = False
+        self.__result = None
+        self.__excInfo = None
+        self.__callbacks = []
+
+    def done(self):
+        return self.__done
+
+    def __wait(self, timeout):
+        self.__cond.acquire()
+        try:
+            if not self.__done:
+                self.__cond.wait(timeout)
+            if not self.__done:
+                raise RuntimeError('Timed out waiting for result')
+        finally:
+            self.__cond.release()
+
+    def result(self, timeout=None):
+        self.__wait(timeout)
+        if self.__excInfo:
+            raise self.__excInfo[0], self.__excInfo[1], self.__excInfo[2]
+        return self.__result
+
+    def exception(self, timeout=None):
+        self.__wait(timeout)
+        return self.__excInfo and self.__excInfo[1]
+
+    # fn is called with the future once it is done, immediately if it
+    # already is
+    def addDoneCallback(self, fn):
+        self.__cond.acquire()
+        try:
+            if not self.__done:
+                self.__callbacks.append(fn)
+                return
+        finally:
+            self.__cond.release()
+        fn(self)
+
+    def setResult(self, result):
+        self.__finish(result, None)
+
+    def setException(self, excInfo=None):
+        self.__finish(None, excInfo or sys.exc_info())
+
+    def __finish(self, result, excInfo):
+        self.__cond.acquire()
+        try:
+            self.__result = result
+            self.__excInfo = excInfo
+            self.__done = True
+            self.__cond.notifyAll()
+            callbacks, self.__callbacks = self.__callbacks, []
+        finally:
+            self.__cond.release()
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                _logger.exception('Future callback failed')
+
+
+class Executor(object):
+    """
+    Runs callables on at most maxWorkers daemon threads.
+
+    Worker threads are started lazily as work is submitted, and exit when
+    the executor is shut down.
+    """
+    def __init__(self, maxWorkers):
+        self.maxWorkers = maxWorkers
+        self.__queue = Queue()
+        self.__lock = threading.Lock()
+        self.__threads = []
+        self.__idle = 0
+        self.__shutdown = False
+
+    def submit(self, fn, *args, **kw):
+        future = Future()
+        if threading.current_thread() in self.__threads:
+            # a worker waiting for the pool it runs on could deadlock it, so
+            # work submitted from a worker is run right away
+            self.__run(future, fn, args, kw)
+            return future
+        self.__lock.acquire()
+        try:
+            if self.__shutdown:
+                raise RuntimeError('Executor has been shut down')
+            self.__queue.put((future, fn, args, kw))
+            if self.__idle:
+                self.__idle -= 1
+            elif len(self.__threads) < self.maxWorkers:
+                t = threading.Thread(target=self.__work)
+                t.daemon = True
+                self.__threads.append(t)
+                t.start()
+        finally:
+            self.__lock.release()
+        return future
+
+    # like map(), the calls run concurrently but the results come back in
+    # the order of items
+    def map(self, fn, items):
+        futures = [self.submit(fn, item) for item in items]
+        return [f.result() for f in futures]
+
+    def shutdown(self, wait=True):
+        self.__lock.acquire()
+        try:
+            self.__shutdown = True
+            threads = list(self.__threads)
+            for t in threads:
+                self.__queue.put(None)
+        finally:
+            self.__lock.release()
+        if wait:
+            for t in threads:
+                t.join()
+
+    def __run(self, future, fn, args, kw):
+        try:
+            future.setResult(fn(*args, **kw))
+        except BaseException:
+            future.setException()
+
+    def __work(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            self.__run(*item)
+            # don't keep the call, and what it holds, alive while idle
+            del item
+            self.__lock.acquire()
+            self.__idle += 1
+            self.__lock.release()
+
+
+def completed(result):
+    """A Future that is already done, with result."""
+    future = Future()
+    future.setResult(result)
+    return future
+
+
+def gather(futures):
+    """Wait for all futures, returning their results in the same order."""
+    return [f.result() for f in futures]
+
+
+def prefetched(iterable, depth=1):
+    """
+    Iterate over iterable on a background thread, which stays at most depth
+    items ahead of the consumer. Exceptions raised by iterable are re-raised
+    to the consumer, and the thread stops once the consumer stops iterating.
+    """
+    return merged([iterable], depth)
+
+
+def merged(iterables, depth=1):
+    """
+    Iterate over all of iterables at once, each on its own background thread
+    staying at most depth items ahead of the consumer, and yield their items
+    as they come. Exceptions raised by any of them are re-raised to the
+    consumer, and the threads stop once the consumer stops iterating.
+    """
+    items = Queue()
+    stop = threading.Event()
+
+    def produce(iterable, slots):
+        try:
+            iterator = iter(iterable)
+            while True:
+                # wait for the consumer to take an item before fetching more
+                while True:
+                    if stop.isSet():
+                        return
+                    try:
+                        slots.get(timeout=0.1)
+                        break
+                    except Empty:
+                        pass
+                try:
+                    item = iterator.next()
+                except StopIteration:
+                    items.put((slots, False, None))
+                    return
+                items.put((slots, True, item))
+        except BaseException:
+            items.put((slots, False, sys.exc_info()))
+
+    running = 0
+    try:
+        for iterable in iterables:
+            slots = Queue()
+            for i in xrange(depth):
+                slots.put(None)
+            t = threading.Thread(target=produce, args=(iterable, slots))
+            t.daemon = True
+            t.start()
+            running += 1
+        while running:
+            slots, more, item = items.get()
+            if not more:
+                if item is not None:
+                    raise item[0], item[1], item[2]
+                running -= 1
+                continue
+            slots.put(None)
+            yield item
+    finally:
+        stop.set()
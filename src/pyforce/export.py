@@ -0,0 +1,405 @@
+'''Stream the records of queries into CSV or JSON Lines files
+
+    python -m pyforce.export -u username -p passwordTOKEN -o contacts.csv.gz \\
+        "SELECT Id, LastName, Account.Name FROM Contact"
+
+    python -m pyforce.export -u username -p passwordTOKEN -d exports -j 8 \\
+        Account Contact Opportunity "SELECT Id, Subject FROM Task"
+'''
+import csv
+import datetime
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from optparse import OptionParser
+from pyforce import Client as PythonClient, CompactQueryRecord, LazyValue
+from pyforce import findKey
+from soql import selectList, selectObject
+from executor import Executor
+from describecache import FileDescribeCache
+
+PROGRESS_EVERY = 1000  # records between progress callbacks
+REPORT_INTERVAL = 10  # seconds between progress reports of a job
+MAX_DESCRIBE = 100  # sObject types per describeSObjects call
+
+_logger = logging.getLogger('pyforce.{0}'.format(__name__))
+
+# field types that can't be selected as such
+compoundtypes = ('address', 'location')
+
+
+class Column(object):
+    """
+    A column of the export, the value at path in each record, e.g.
+    ['Account', 'Name'] for Account.Name. Child relationship subqueries
+    give a column of record lists, which only JSON Lines can hold.
+    """
+    def __init__(self, name, path, child=False):
+        self.name = name
+        self.path = path
+        self.child = child
+        self.__keys = [None] * len(path)
+
+    def value(self, record):
+        for i, name in enumerate(self.path):
+            if not isinstance(record, (dict, CompactQueryRecord)):
+                return None  # e.g. a parent lookup that isn't set
+            key = self.__keys[i]
+            if key is None or key not in record:
+                key = findKey(record, name)
+                if key is None:
+                    return None
+                self.__keys[i] = key
+            record = record[key]
+        return record
+
+
+def selectColumns(soql):
+    """The columns of the select list of soql."""
+    items, sObjectType, fromAlias = selectList(soql)
+    columns = []
+    expressions = 0
+    for item in items:
+        if item.startswith('('):  # child relationship subquery
+            name = selectObject(item[1:-1]).split('.')[-1]
+            columns.append(Column(name, [name], child=True))
+        elif ')' in item:  # aggregate, named by its alias or exprN
+            alias = item[item.rindex(')') + 1:].strip()
+            if not alias:
+                alias = 'expr%d' % expressions
+                expressions += 1
+            columns.append(Column(alias, [alias]))
+        else:
+            path = item.split('.')
+            if len(path) > 1 and path[0].lower() == fromAlias:
+                path = path[1:]
+            columns.append(Column('.'.join(path), path))
+    return columns
+
+
+def objectSoql(client, sObjectType):
+    """A query of all the fields of sObjectType."""
+    return describedSoql(client.describeSObjects(sObjectType)[0])
+
+
+def describedSoql(description):
+    """A query of all the fields of a described sObject type."""
+    names = [f.name for f in description.fields.values()
+             if f.type not in compoundtypes]
+    names.sort()
+    if 'Id' in names:
+        names.remove('Id')
+        names.insert(0, 'Id')
+    return 'SELECT %s FROM %s' % (', '.join(names), description.name)
+
+
+def _isoformat(value):
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return value.isoformat() + 'Z'  # the API's datetimes are UTC
+    return value.isoformat()
+
+
+def _jsonDefault(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return _isoformat(value)
+    if isinstance(value, CompactQueryRecord):
+        return dict(value.iteritems())
+    if isinstance(value, LazyValue):
+        return value.decode()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def _csvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return _isoformat(value)
+    if isinstance(value, list):
+        return ';'.join(value)
+    if isinstance(value, dict):
+        return json.dumps(value, default=_jsonDefault)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class CSVWriter(object):
+    """Writes a header row, then a row per record, without child columns."""
+    def __init__(self, out, columns):
+        self.columns = [c for c in columns if not c.child]
+        self.writer = csv.writer(out)
+        self.writer.writerow([c.name for c in self.columns])
+
+    def write(self, record):
+        self.writer.writerow([_csvValue(c.value(record))
+                              for c in self.columns])
+
+
+class JSONLinesWriter(object):
+    """Writes a JSON object per record, with its columns in order."""
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+        self.names = [json.dumps(c.name) for c in columns]
+
+    def write(self, record):
+        values = [json.dumps(c.value(record), default=_jsonDefault)
+                  for c in self.columns]
+        self.out.write('{%s}\n' % ', '.join(['%s: %s' % item for item in
+                                             zip(self.names, values)]))
+
+writers = {'csv': CSVWriter, 'jsonl': JSONLinesWriter}
+
+
+def export(client, soql, out, format='csv', prefetch=1, progress=None,
+           partitions=1):
+    """
+    Write the records of soql to the file object out, as format ('csv' or
+    'jsonl'), and return how many there were.
+
+    Records are streamed page by page with query_iter, so only a few pages
+    are held in memory at any time. With partitions above 1 the query is
+    split into Id ranges read in parallel by query_partitioned, and the
+    records are written in no particular order. progress is called with the
+    number of records written so far every PROGRESS_EVERY records.
+    """
+    writer = writers[format](out, selectColumns(soql))
+    if partitions > 1:
+        records = client.query_partitioned(soql, partitions, prefetch=prefetch)
+    else:
+        records = client.query_iter(soql, prefetch)
+    count = 0
+    for record in records:
+        writer.write(record)
+        count += 1
+        if progress is not None and not count % PROGRESS_EVERY:
+            progress(count)
+    return count
+
+
+class ExportJob(object):
+    """
+    The export of one query by exportAll, to path. Once done, records is
+    the number of records written, or error the exception that stopped it.
+    """
+    def __init__(self, name, soql, path):
+        self.name = name
+        self.soql = soql
+        self.path = path
+        self.records = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.__reported = 0
+
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    def rate(self):
+        """Records written per second."""
+        elapsed = self.elapsed()
+        return elapsed and self.records / elapsed
+
+    def progress(self, count):
+        self.records = count
+        now = time.time()
+        if now - self.__reported >= REPORT_INTERVAL:
+            self.__reported = now
+            _logger.info('{0}: {1} records, {2:.0f}/s'.format(
+                self.name, self.records, self.rate()))
+
+    def run(self, client, format='csv', compress=False, partitions=1):
+        self.started = time.time()
+        try:
+            out = openOutput(self.path, compress)
+            try:
+                self.records = export(client, self.soql, out, format,
+                                      progress=self.progress,
+                                      partitions=partitions)
+            finally:
+                out.close()
+        except Exception, e:
+            self.error = e
+            _logger.exception('{0} failed'.format(self.name))
+        self.finished = time.time()
+        if self.error is None:
+            _logger.info('{0}: done, {1} records in {2:.1f}s, {3:.0f}/s'.format(
+                self.name, self.records, self.elapsed(), self.rate()))
+
+
+def exportAll(client, queries, directory, format='csv', compress=False,
+              concurrency=4, partitions=1):
+    """
+    Export each of queries, sObject names or SOQL, into its own file in
+    directory, running up to concurrency exports at once over the logged in
+    client. Returns the ExportJobs, in the order of queries.
+
+    The sObjects named are described together up front and the queries
+    get their descriptions from the client's cache, so the client should
+    have cacheTypeDescriptions on, and at least concurrency * partitions
+    maxConnections.
+    A failed export, or an sObject name that can't be described, is logged
+    and doesn't stop the others.
+    """
+    jobs = list()
+    paths = set()
+    for query in queries:
+        query = query.strip()
+        if ' ' in query:
+            name, soql = selectObject(query), query
+        else:
+            name, soql = query, None
+        path = os.path.join(directory, '%s.%s' % (name, format))
+        n = 1
+        while path in paths:
+            n += 1
+            path = os.path.join(directory, '%s_%d.%s' % (name, n, format))
+        paths.add(path)
+        if compress:
+            path += '.gz'
+        jobs.append(ExportJob(name, soql, path))
+
+    names = [job.name for job in jobs if job.soql is None]
+    descriptions = dict()
+    errors = dict()
+    for i in xrange(0, len(names), MAX_DESCRIBE):
+        batch = names[i:i + MAX_DESCRIBE]
+        try:
+            descriptions.update(client.typeDescs.getMany(
+                batch, client.queryTypesDescriptions))
+        except Exception:
+            # a single name that can't be described fails the whole call,
+            # describe them one by one to tell which
+            for name in batch:
+                try:
+                    descriptions.update(client.typeDescs.getMany(
+                        [name], client.queryTypesDescriptions))
+                except Exception, e:
+                    errors[name] = e
+    for job in jobs:
+        if job.soql is not None:
+            continue
+        if job.name in errors:
+            job.error = errors[job.name]
+            _logger.error('{0} failed: {1}'.format(job.name, job.error))
+        else:
+            job.soql = describedSoql(descriptions[job.name])
+
+    executor = Executor(concurrency)
+    try:
+        futures = [executor.submit(job.run, client, format, compress,
+                                   partitions)
+                   for job in jobs if job.error is None]
+        for future in futures:
+            future.result()
+    finally:
+        executor.shutdown()
+    return jobs
+
+
+def openOutput(path, compress=False):
+    """A file object writing to path ('-' for stdout), gzipped if asked."""
+    if path == '-':
+        out = sys.stdout
+        if compress:
+            return gzip.GzipFile(fileobj=out, mode='wb')
+        return out
+    if compress or path.endswith('.gz'):
+        return gzip.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def outputFormat(path):
+    for format in writers:
+        if ('.' + format) in os.path.basename(path):
+            return format
+    return 'csv'
+
+
+def main(args=None):
+    parser = OptionParser(
+        usage='python -m pyforce.export [options] <sObjectName or SOQL>\n'
+              '       python -m pyforce.export [options] -d DIRECTORY '
+              '<sObjectName or SOQL>...')
+    parser.add_option('-u', '--username',
+                      default=os.environ.get('PYFORCE_USERNAME'),
+                      help='defaults to $PYFORCE_USERNAME')
+    parser.add_option('-p', '--password',
+                      default=os.environ.get('PYFORCE_PASSWORD'),
+                      help='password and security token, defaults to '
+                           '$PYFORCE_PASSWORD')
+    parser.add_option('-s', '--server-url', dest='serverUrl',
+                      help='login url, for sandboxes or API versions')
+    parser.add_option('-o', '--output', default='-',
+                      help='file to write, - (the default) for stdout')
+    parser.add_option('-f', '--format', choices=sorted(writers.keys()),
+                      help='csv or jsonl, by default from the output '
+                           'file name or csv')
+    parser.add_option('-z', '--gzip', action='store_true', default=False,
+                      help='compress the output, implied by a .gz output')
+    parser.add_option('-b', '--batch-size', dest='batchSize', type='int',
+                      default=2000, help='records per query page')
+    parser.add_option('-d', '--directory',
+                      help='export each query to a file of this directory, '
+                           'named after its sObject')
+    parser.add_option('-j', '--jobs', type='int', default=4,
+                      help='queries exported at once with -d, default 4')
+    parser.add_option('-P', '--partitions', type='int', default=1,
+                      help='split each query into this many Id ranges '
+                           'read in parallel, default 1')
+    parser.add_option('--describe-cache', dest='describeCache',
+                      help='directory keeping sObject descriptions between '
+                           'runs')
+    options, args = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not args or (len(args) > 1 and not options.directory):
+        parser.error('expected an sObject name or a SOQL query, or several '
+                     'with --directory')
+    if not (options.username and options.password):
+        parser.error('username and password are required')
+
+    describeCache = None
+    if options.describeCache:
+        describeCache = FileDescribeCache(options.describeCache)
+    client = PythonClient(options.serverUrl, cacheTypeDescriptions=True,
+                          maxConnections=options.jobs * options.partitions,
+                          saxDecoding=True,
+                          describeCache=describeCache)
+    client.batchSize = options.batchSize
+    client.login(options.username, options.password)
+    if options.directory:
+        if not os.path.isdir(options.directory):
+            os.makedirs(options.directory)
+        jobs = exportAll(client, args, options.directory,
+                         options.format or 'csv', options.gzip, options.jobs,
+                         options.partitions)
+        failed = [job.name for job in jobs if job.error is not None]
+        if failed:
+            _logger.error('failed: {0}'.format(', '.join(failed)))
+            return 1
+        return 0
+    soql = args[0]
+    if ' ' not in soql.strip():
+        soql = objectSoql(client, soql.strip())
+    out = openOutput(options.output, options.gzip)
+    try:
+        count = export(client, soql, out,
+                       options.format or outputFormat(options.output),
+                       partitions=options.partitions)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    _logger.info('exported {0} records'.format(count))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,8 +12,14 @@ datetimeregx = re.compile(
     r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(\.\d+)(.*)'
 )
 
+tzregx = re.compile(r'^([+-])(\d{2}):?(\d{2})$')
+
 doubleregx = re.compile(r'^(\d)+(\.\d+)?$')
 
+# datetimes get a UTC tzinfo, instead of being naive UTC datetimes
+timezoneAware = False
+MEMO_SIZE = 4096  # recently converted date and datetime texts kept
+
 stringtypes = ('string', 'id', 'phone', 'url', 'email',
                'anyType', 'picklist', 'reference', 'encryptedstring')
 
@@ -26,6 +32,7 @@ multitypes = ('combobox', 'multipicklist')
 dicttypes = ('address')
 
 _marshallers = dict()
+_converters = dict()
 
 
 def marshall(fieldtype, fieldname, xml, ns=_tSObjectNS):
@@ -38,23 +45,59 @@ def register(fieldtypes, func):
         fieldtypes = [fieldtypes]
     for t in fieldtypes:
         _marshallers[t] = func
+        # a custom marshaller replaces any converter for the type
+        _converters.pop(t, None)
+
+
+# Converters turn the text content of a field straight into a value, for
+# decoders that never build an xmltramp element for the field. Types without
+# a converter (e.g. address) have to go through their marshaller.
+def registerConverter(fieldtypes, func):
+    if type(fieldtypes) not in (ListType, TupleType, DictType):
+        fieldtypes = [fieldtypes]
+    for t in fieldtypes:
+        _converters[t] = func
+
+
+def converter(fieldtype):
+    return _converters.get(fieldtype)
+
+
+def nodeText(node):
+    return u''.join([unicode(x) for x in node._dir])
+
+
+def stringConverter(text):
+    # same whitespace folding as str() of an xmltramp element
+    return ' '.join(text.split()).encode('utf-8')
 
 
 def stringMarshaller(fieldname, xml, ns):
     return str(xml[getattr(ns, fieldname)])
 
 register(stringtypes, stringMarshaller)
+registerConverter(stringtypes, stringConverter)
+
+
+def textConverter(text):
+    # Avoid removal of newlines.
+    return text.encode('utf-8')
 
 
 def textMarshaller(fieldname, xml, ns):
     # Avoid removal of newlines.
     node = xml[getattr(ns, fieldname)]
-    text = ''
-    for x in node._dir:
-        text += unicode(x)
-    return text.encode('utf-8')
+    return nodeText(node).encode('utf-8')
 
 register(texttypes, textMarshaller)
+registerConverter(texttypes, textConverter)
+
+
+def multiConverter(text):
+    asString = stringConverter(text)
+    if not asString:
+        return []
+    return asString.split(';')
 
 
 def multiMarshaller(fieldname, xml, ns):
@@ -64,12 +107,26 @@ def multiMarshaller(fieldname, xml, ns):
     return asString.split(';')
 
 register(multitypes, multiMarshaller)
+registerConverter(multitypes, multiConverter)
+
+
+def booleanConverter(text):
+    return stringConverter(text) == 'true'
 
 
 def booleanMarshaller(fieldname, xml, ns):
     return pyforce._bool(xml[getattr(ns, fieldname)])
 
 register('boolean', booleanMarshaller)
+registerConverter('boolean', booleanConverter)
+
+
+def integerConverter(text):
+    try:
+        i = int(text)
+        return i
+    except:
+        return None
 
 
 def integerMarshaller(fieldname, xml, ns):
@@ -81,6 +138,15 @@ def integerMarshaller(fieldname, xml, ns):
         return None
 
 register('int', integerMarshaller)
+registerConverter('int', integerConverter)
+
+
+def doubleConverter(text):
+    try:
+        i = float(text)
+        return i
+    except:
+        return None
 
 
 def doubleMarshaller(fieldname, xml, ns):
@@ -92,10 +158,59 @@ def doubleMarshaller(fieldname, xml, ns):
         return None
 
 register(doubletypes, doubleMarshaller)
+registerConverter(doubletypes, doubleConverter)
 
 
-def dateMarshaller(fieldname, xml, ns):
-    datestr = str(xml[getattr(ns, fieldname)])
+_zero = datetime.timedelta(0)
+
+
+class UTC(datetime.tzinfo):
+    def utcoffset(self, dt):
+        return _zero
+
+    def dst(self, dt):
+        return _zero
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def __repr__(self):
+        return 'utc'
+
+    def __reduce__(self):
+        return 'utc'
+
+utc = UTC()
+
+# text -> value, the same texts come again and again within a page, e.g.
+# the CreatedDate of records loaded together
+_dateMemo = dict()
+_dateTimeMemos = {False: dict(), True: dict()}  # by timezoneAware
+
+
+def _memoize(memo, text, value):
+    if value is not None:
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        memo[text] = value
+    return value
+
+
+def dateConverter(text):
+    value = _dateMemo.get(text)
+    if value is None:
+        value = _memoize(_dateMemo, text, _parseDate(text))
+    return value
+
+
+def _parseDate(text):
+    if len(text) == 10 and text[4] == '-' and text[7] == '-':
+        try:
+            return datetime.date(int(text[:4]), int(text[5:7]),
+                                 int(text[8:]))
+        except ValueError:
+            pass
+    datestr = stringConverter(text)
     match = dateregx.match(datestr)
     if match:
         grps = match.groups()
@@ -105,11 +220,39 @@ def dateMarshaller(fieldname, xml, ns):
         return datetime.date(year, month, day)
     return None
 
-register('date', dateMarshaller)
 
+def dateMarshaller(fieldname, xml, ns):
+    return dateConverter(nodeText(xml[getattr(ns, fieldname)]))
 
-def dateTimeMarshaller(fieldname, xml, ns):
-    datetimestr = str(xml[getattr(ns, fieldname)])
+register('date', dateMarshaller)
+registerConverter('date', dateConverter)
+
+
+def dateTimeConverter(text):
+    memo = _dateTimeMemos[timezoneAware]
+    value = memo.get(text)
+    if value is None:
+        value = _memoize(memo, text, _parseDateTime(text))
+    return value
+
+
+def _parseDateTime(text):
+    # YYYY-MM-DDTHH:MM:SS.sssZ, the way Salesforce writes them
+    if len(text) == 24 and text[4] == '-' and text[7] == '-' and \
+            text[10] == 'T' and text[13] == ':' and text[16] == ':' and \
+            text[19] == '.' and text[23] == 'Z':
+        try:
+            value = datetime.datetime(
+                int(text[:4]), int(text[5:7]), int(text[8:10]),
+                int(text[11:13]), int(text[14:16]), int(text[17:19]),
+                int(text[20:23]) * 1000)
+        except ValueError:
+            pass
+        else:
+            if timezoneAware:
+                return value.replace(tzinfo=utc)
+            return value
+    datetimestr = stringConverter(text)
     match = datetimeregx.match(datetimestr)
     if match:
         grps = match.groups()
@@ -121,14 +264,26 @@ def dateTimeMarshaller(fieldname, xml, ns):
         second = int(grps[5])
         secfrac = float(grps[6])
         microsecond = int(secfrac * (10**6))
-        tz = grps[7]  # XXX not sure if I need to do anything with this. sofar
-                      # times appear to be UTC
-        return datetime.datetime(
+        value = datetime.datetime(
             year, month, day, hour, minute, second, microsecond
         )
+        # Z or an offset from UTC, which is taken off
+        offset = tzregx.match(grps[7].strip())
+        if offset is not None:
+            sign, hours, minutes = offset.groups()
+            delta = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+            value = sign == '+' and value - delta or value + delta
+        if timezoneAware:
+            return value.replace(tzinfo=utc)
+        return value
     return None
 
+
+def dateTimeMarshaller(fieldname, xml, ns):
+    return dateTimeConverter(nodeText(xml[getattr(ns, fieldname)]))
+
 register('datetime', dateTimeMarshaller)
+registerConverter('datetime', dateTimeConverter)
 
 
 def base64Marshaller(fieldname, xml, ns):
@@ -136,6 +291,7 @@ def base64Marshaller(fieldname, xml, ns):
 
 
 register('base64', base64Marshaller)
+registerConverter('base64', stringConverter)
 
 
 def dictMarshaller(fieldname, xml, ns):
@@ -1,15 +1,27 @@
 import logging
+from urlparse import urlparse
 from xmlclient import _tPartnerNS, _tSObjectNS, _tSchemaInstanceNS
 from xmlclient import Client as BaseClient
-from marshall import marshall
+from xmlclient import SessionTimeoutError, locatorregx
+from marshall import marshall, converter, nodeText, stringConverter
+from marshall import stringtypes, texttypes
+from describecache import describeKey, LRUDict, TypeDescriptionCache
+from executor import completed
+from soql import relationships
 from types import TupleType, ListType
 import re
 import copy
-from xmltramp import Namespace
+import itertools
+import threading
+from collections import Mapping
+from xmltramp import Namespace, Element, Seeder
 
 _tSchemaNS = Namespace('http://www.w3.org/2001/XMLSchema')
 
 DEFAULT_FIELD_TYPE = "string"
+MAX_RETRIEVE_IDS = 2000  # per retrieve call, larger retrieves are split up
+MAX_SAVE_BATCH = 200  # records per create, update, upsert or delete call
+LAZY_PAGES = 8  # queryMore pages kept by a LazyQueryRecordSet
 querytyperegx = re.compile('(?:from|FROM) (\S+)')
 
 _logger = logging.getLogger("pyforce.{0}".format(__name__))
@@ -27,6 +39,212 @@ class QueryRecord(dict):
         self[n] = v
 
 
+# field types whose values are converted right away by lazy records, as
+# keeping their text for later costs about as much
+eagertypes = stringtypes + (texttypes,)
+
+
+class LazyValue(object):
+    """
+    The text of a field of a LazyQueryRecord, or its xmltramp element, and
+    the converter turning it into the field value.
+    """
+    __slots__ = ('convert', 'text')
+
+    def __init__(self, convert, text):
+        self.convert = convert
+        self.text = text
+
+    def decode(self):
+        text = self.text
+        if not isinstance(text, basestring):
+            text = nodeText(text)
+        return self.convert(text)
+
+    def __repr__(self):
+        return repr(self.decode())
+
+
+class LazyQueryRecord(QueryRecord):
+    """
+    A QueryRecord whose fields are converted when first read, then kept.
+
+    Reading a field by key or attribute, get(), values(), items(), ==,
+    copies and pickles see converted values, but dict(record), **record and
+    json.dumps() don't: call decodeAll() before those.
+    """
+    def __getitem__(self, n):
+        value = dict.__getitem__(self, n)
+        if type(value) is LazyValue:
+            value = value.decode()
+            dict.__setitem__(self, n, value)
+        return value
+
+    def decodeAll(self):
+        for n, value in dict.items(self):
+            if type(value) is LazyValue:
+                dict.__setitem__(self, n, value.decode())
+        return self
+
+    def get(self, n, default=None):
+        if n in self:
+            return self[n]
+        return default
+
+    def values(self):
+        return dict.values(self.decodeAll())
+
+    def items(self):
+        return dict.items(self.decodeAll())
+
+    def itervalues(self):
+        return dict.itervalues(self.decodeAll())
+
+    def iteritems(self):
+        return dict.iteritems(self.decodeAll())
+
+    def pop(self, n, *default):
+        if n in self:
+            self[n]
+        return dict.pop(self, n, *default)
+
+    def popitem(self):
+        return dict.popitem(self.decodeAll())
+
+    def setdefault(self, n, default=None):
+        if n in self:
+            return self[n]
+        return dict.setdefault(self, n, default)
+
+    def copy(self):
+        return QueryRecord(self.iteritems())
+
+    def __reduce__(self):
+        return QueryRecord, (dict(self.iteritems()),)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyQueryRecord):
+            other.decodeAll()
+        return dict.__eq__(self.decodeAll(), other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return dict.__repr__(self.decodeAll())
+
+
+class CompactQueryRecord(object):
+    """
+    Base of the record classes made by compactRecordClass, which keep the
+    fields of a record in __slots__ instead of a dict.
+
+    They read like a QueryRecord, as attributes or as a mapping, and their
+    fields can be set, but fields can't be added. Copies and pickles are
+    plain QueryRecords, as the classes are made on the fly.
+    """
+    __slots__ = ()
+    _fields = ()  # field names, in the order of the response
+    _fieldSet = frozenset()
+
+    def __getitem__(self, n):
+        if n in self._fieldSet:
+            return getattr(self, n)
+        raise KeyError(n)
+
+    def __setitem__(self, n, v):
+        if n not in self._fieldSet:
+            raise KeyError(n)
+        setattr(self, n, v)
+
+    def get(self, n, default=None):
+        if n in self._fieldSet:
+            return getattr(self, n)
+        return default
+
+    def __contains__(self, n):
+        return n in self._fieldSet
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def keys(self):
+        return list(self._fields)
+
+    iterkeys = __iter__
+
+    def values(self):
+        return [getattr(self, n) for n in self._fields]
+
+    def itervalues(self):
+        for n in self._fields:
+            yield getattr(self, n)
+
+    def items(self):
+        return [(n, getattr(self, n)) for n in self._fields]
+
+    def iteritems(self):
+        for n in self._fields:
+            yield n, getattr(self, n)
+
+    def copy(self):
+        return QueryRecord(self.iteritems())
+
+    def __reduce__(self):
+        return QueryRecord, (dict(self.iteritems()),)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal is NotImplemented and equal or not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+Mapping.register(CompactQueryRecord)
+
+
+def compactRecordClass(sObjectType, fieldNames):
+    """
+    A CompactQueryRecord subclass for records of sObjectType with the fields
+    fieldNames.
+    """
+    names = []
+    for n in fieldNames:
+        if n not in names:  # e.g. Id comes twice
+            names.append(n)
+    return type('%sRecord' % sObjectType, (CompactQueryRecord,), {
+        '__slots__': tuple(names),
+        '_fields': tuple(names),
+        '_fieldSet': frozenset(names)})
+
+
+def findKey(record, name):
+    """
+    The key of record, or of any mapping such as the fields of a
+    description, matching name regardless of case, or None. SOQL is case
+    insensitive while records use the API names.
+    """
+    if name in record:
+        return name
+    name = name.lower()
+    for key in record:
+        if key.lower() == name:
+            return key
+    return None
+
+
 class QueryRecordSet(list):
 
     def __init__(self, records, done, size, **kw):
@@ -52,6 +270,112 @@ class QueryRecordSet(list):
             return list.__getitem__(self, n)
 
 
+class LazyQueryRecordSet(object):
+    """
+    The records of a query, fetched with queryMore as they are accessed.
+
+    len() is the size of the whole result. Indexing and slicing fetch the
+    page holding the records asked for: the query locator of the first page
+    is reused with the offset of that page, so any record can be reached
+    without going through the pages before it. Only the first page and the
+    maxPages most recently used other pages are kept. Locators expire when
+    unused for a while, so the set should not be kept around for long.
+    """
+    def __init__(self, client, first, maxPages=LAZY_PAGES):
+        self.client = client
+        self.size = first.size
+        self.maxPages = maxPages
+        self.__first = list(first)
+        self.__step = len(first) or 1
+        self.__lock = threading.Lock()
+        self.__pages = dict()  # start -> [last used, records]
+        self.__ticks = itertools.count()
+        self.__locators = dict()  # start of a page -> its query locator
+        self.__cursor = None
+        if not first.done:
+            self.__locators[len(first)] = first.queryLocator
+            match = locatorregx.match(first.queryLocator)
+            if match:
+                self.__cursor = match.group(1)
+
+    @property
+    def records(self):
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        i = 0
+        while i < self.size:
+            start, records = self.__page(i)
+            for record in records[i - start:]:
+                yield record
+            i = start + len(records)
+
+    def __getitem__(self, n):
+        if isinstance(n, basestring):
+            try:
+                return getattr(self, n)
+            except AttributeError:
+                raise KeyError(n)
+        if isinstance(n, slice):
+            return [self[i] for i in xrange(*n.indices(self.size))]
+        if n < 0:
+            n += self.size
+        if not 0 <= n < self.size:
+            raise IndexError('record index out of range')
+        start, records = self.__page(n)
+        return records[n - start]
+
+    def __repr__(self):
+        return '<LazyQueryRecordSet of %d records>' % self.size
+
+    # (start, records) of a page holding record n
+    def __page(self, n):
+        if n < len(self.__first):
+            return 0, self.__first
+        self.__lock.acquire()
+        try:
+            for start, page in self.__pages.items():
+                if start <= n < start + len(page[1]):
+                    page[0] = self.__ticks.next()
+                    return start, page[1]
+            if self.__cursor is None:
+                # opaque locators, walk from the closest page before n
+                start = max([s for s in self.__locators if s <= n])
+                records = self.__fetch(start)
+                while start + len(records) <= n:
+                    start += len(records)
+                    records = self.__fetch(start)
+                return start, records
+            start = n - n % self.__step
+            records = self.__fetch(start)
+            if not start <= n < start + len(records):
+                # the server sent a shorter page than the first one
+                start = n
+                records = self.__fetch(start)
+            return start, records
+        finally:
+            self.__lock.release()
+
+    def __fetch(self, start):
+        locator = self.__locators.get(start)
+        if locator is None:
+            locator = '%s-%d' % (self.__cursor, start)
+        res = self.client.queryMore(locator)
+        records = list(res)
+        if not records:
+            raise IndexError('no records at offset %d' % start)
+        if not res.done:
+            self.__locators[start + len(records)] = res.queryLocator
+        pages = self.__pages
+        pages[start] = [self.__ticks.next(), records]
+        while len(pages) > self.maxPages:
+            del pages[min(pages, key=lambda s: pages[s][0])]
+        return records
+
+
 class SObject(object):
 
     def __init__(self, **kw):
@@ -59,22 +383,310 @@ class SObject(object):
             setattr(self, k, v)
 
     def marshall(self, fieldname, xml):
-        if fieldname in self.fields.keys():
+        if fieldname in self.fields:
             field = self.fields[fieldname]
         else:
             return marshall(DEFAULT_FIELD_TYPE, fieldname, xml)
         return field.marshall(xml)
 
+    # like marshall, from the text content of the field rather than the
+    # element holding it
+    def marshallText(self, fieldname, text):
+        field = self.fields.get(fieldname)
+        fieldtype = field and field.type or DEFAULT_FIELD_TYPE
+        convert = converter(fieldtype)
+        if convert is None:
+            node = Element(_tSObjectNS[fieldname], children=text and [text])
+            return self.marshallNode(fieldname, node)
+        return convert(text)
+
+    # like marshallText, leaving the conversion of the field to when it is
+    # first read from a LazyQueryRecord
+    def lazyText(self, fieldname, text):
+        field = self.fields.get(fieldname)
+        fieldtype = field and field.type or DEFAULT_FIELD_TYPE
+        convert = converter(fieldtype)
+        if convert is None or fieldtype in eagertypes:
+            return self.marshallText(fieldname, text)
+        return LazyValue(convert, text)
+
+    # marshall a field element on its own, without its record
+    def marshallNode(self, fieldname, node):
+        return self.marshall(fieldname, Element('record', children=[node]))
+
+
+# kinds of record content collected by RecordSeeder
+_TEXT, _NODE, _RECORD, _RESULT = range(4)
+_xsiType = (_tSchemaInstanceNS.type[0], 'type')
+_xsiNil = (_tSchemaInstanceNS.nil[0], 'nil')
+
+
+def compileMarshallPlan(type_data, names):
+    """
+    Work out once how to marshall records of a type whose field elements
+    are named names, in document order.
+
+    Each step of the plan is (fname, first, convert, fieldtype): first is the
+    position of the first element with that name, which is the one the
+    marshallers read, and convert turns its text into a value. Field types
+    without a converter are left to their marshaller.
+    """
+    plan = []
+    first = {}
+    for i, name in enumerate(names):
+        fname = str(name[1])
+        field = type_data.fields.get(fname)
+        fieldtype = field and field.type or DEFAULT_FIELD_TYPE
+        plan.append((fname, first.setdefault(name, i), converter(fieldtype),
+                     fieldtype))
+    return tuple(plan)
+
+
+class RecordSeeder(Seeder):
+    """
+    Decodes the sObjects of a query, queryMore, search or retrieve response
+    into QueryRecords straight from the SAX events, without building their
+    xmltramp tree.
+
+    Everything outside of sObjects is built into the usual tree, so faults,
+    done, size and queryLocator are read from the parse result as before.
+    While an sObject is open only the text of its fields is collected, and
+    each top level sObject is kept as it is read. Once the response is
+    parsed (and its connection is back in the pool), decode() loads the
+    descriptions of all the record types in it with a single
+    loadTypes(types) call and marshalls the fields from their text,
+    returning the records. Fields with child elements (e.g. address) still
+    get a small tree, for their marshaller. A nil top level result, which
+    retrieve returns for an id that doesn't exist, decodes to None.
+    """
+    def __init__(self, loadTypes, recordClass=None, lazy=False):
+        Seeder.__init__(self)
+        self.loadTypes = loadTypes
+        self.recordClass = recordClass
+        self.lazy = lazy and recordClass is None
+        self.startDocument()
+
+    # also called when a retried request is parsed again
+    def startDocument(self):
+        self.stack = []
+        self.ch = []
+        self.prefixes = {}
+        self.items = []
+        self.__frames = []  # open sObjects / QueryResults: (kind, name, items)
+        self.__field = None  # (name, attrs) of the field being read
+        self.__text = []
+        self.__nodes = None  # element stack of a field with child elements
+
+    def startElementNS(self, name, qname, attrs):
+        if self.__nodes is not None:
+            self.__flushNodeText()
+            self.__nodes.append(Element(name, dict(attrs)))
+            return
+        if self.__field is not None:
+            # the field being read has child elements, build it as a tree
+            fieldName, fieldAttrs = self.__field
+            self.__nodes = [Element(fieldName, fieldAttrs)]
+            self.__flushNodeText()
+            self.__nodes.append(Element(name, dict(attrs)))
+            return
+        xsiType = attrs.get(_xsiType)
+        if not self.__frames:
+            if xsiType != 'sf:sObject':
+                if name[1] == 'result' and attrs.get(_xsiNil) == 'true':
+                    self.items.append(None)
+                return Seeder.startElementNS(self, name, qname, attrs)
+            self.flushCharacters()
+            self.__frames.append((_RECORD, None, []))
+        elif xsiType == 'sf:sObject':
+            self.__frames.append((_RECORD, str(name[1]), []))
+        elif xsiType == 'QueryResult':
+            self.__frames.append((_RESULT, str(name[1]), []))
+        else:
+            self.__field = (name, dict(attrs))
+            self.__text = []
+
+    def characters(self, ch):
+        if self.__frames:
+            self.__text.append(ch)
+        else:
+            Seeder.characters(self, ch)
+
+    def endElementNS(self, name, qname):
+        if self.__nodes is not None:
+            self.__flushNodeText()
+            node = self.__nodes.pop()
+            if self.__nodes:
+                self.__nodes[-1]._dir.append(node)
+                return
+            self.__nodes = self.__field = None
+            self.__frames[-1][2].append((str(name[1]), _NODE, node))
+        elif self.__field is not None:
+            text = u''.join(self.__text)
+            if text.isspace():
+                text = u''
+            self.__text = []
+            self.__field = None
+            self.__frames[-1][2].append((str(name[1]), _TEXT, text))
+        elif self.__frames:
+            kind, fname, items = self.__frames.pop()
+            self.__text = []
+            if self.__frames:
+                self.__frames[-1][2].append((fname, kind, items))
+            else:
+                self.items.append(items)
+        else:
+            Seeder.endElementNS(self, name, qname)
+
+    def __flushNodeText(self):
+        text = u''.join(self.__text)
+        self.__text = []
+        if text and not text.isspace():
+            self.__nodes[-1]._dir.append(text)
+
+    def decode(self):
+        """
+        Return the records of the parsed response, describing their types.
+        Call it after the parse rather than from a SAX callback, a describe
+        mustn't wait for the connection the response is still read from.
+        """
+        types = set()
+        for items in self.items:
+            _collectRecordTypes(items, types)
+        typeDescs = types and self.loadTypes(types) or {}
+        records = []
+        for items in self.items:
+            if items is None:
+                records.append(None)
+            else:
+                records.append(self.__record(items, typeDescs))
+        return records
+
+    def __record(self, items, typeDescs):
+        if not items:
+            return QueryRecord()
+        row_type = _recordType(items)
+        type_data = typeDescs[row_type]
+        marshallText = type_data.marshallText
+        if self.recordClass is not None:
+            record = self.recordClass(row_type,
+                                      tuple([item[0] for item in items]))()
+        elif self.lazy:
+            record = LazyQueryRecord()
+            marshallText = type_data.lazyText
+        else:
+            record = QueryRecord()
+        for fname, kind, value in items:
+            if kind == _TEXT:
+                record[fname] = marshallText(fname, value)
+            elif kind == _RECORD:
+                record[fname] = self.__record(value, typeDescs)
+            elif kind == _RESULT:
+                record[fname] = self.__recordSet(value, typeDescs)
+            else:
+                record[fname] = type_data.marshallNode(fname, value)
+        return record
+
+    def __recordSet(self, items, typeDescs):
+        records = []
+        done = size = u''
+        for fname, kind, value in items:
+            if kind == _RECORD:
+                records.append(self.__record(value, typeDescs))
+            elif fname == 'done':
+                done = value
+            elif fname == 'size':
+                size = value
+        return QueryRecordSet(
+            records=records,
+            done=stringConverter(done) == 'true',
+            size=int(size)
+        )
+
+
+def _recordType(items):
+    for fname, kind, value in items:
+        if fname == 'type' and kind == _TEXT:
+            return stringConverter(value)
+
+
+def _collectRecordTypes(items, types):
+    if items:
+        types.add(_recordType(items))
+        for fname, kind, value in items:
+            if kind == _RECORD:
+                _collectRecordTypes(value, types)
+            elif kind == _RESULT:
+                for rname, rkind, record in value:
+                    if rkind == _RECORD:
+                        _collectRecordTypes(record, types)
+
+
+class _Undescribed(Exception):
+    def __init__(self, sObjectType):
+        Exception.__init__(self, sObjectType)
+        self.sObjectType = sObjectType
+
+
+# type -> description of the types met while extracting records, taken from
+# client's cache on first use; types that aren't cached, or all of them when
+# caching is off, raise _Undescribed until their description is added
+class _TypeLookup(dict):
+    def __init__(self, client):
+        dict.__init__(self)
+        self.client = client
+        self.described = set()  # types whose description has been loaded
+
+    def __missing__(self, sObjectType):
+        if sObjectType in self.described:
+            raise KeyError(sObjectType)
+        if not (self.client.cacheTypeDescriptions and
+                sObjectType in self.client.typeDescs):
+            raise _Undescribed(sObjectType)
+        self.update(self.client._typeDescriptions([sObjectType]))
+        self.described.add(sObjectType)
+        return dict.__getitem__(self, sObjectType)
+
+    def add(self, sObjectTypes, descriptions):
+        self.described.update(sObjectTypes)
+        self.update(descriptions)
+
 
 class Client(BaseClient):
 
     cacheTypeDescriptions = False
-
-    def __init__(self, serverUrl=None, cacheTypeDescriptions=False):
-        BaseClient.__init__(self, serverUrl=serverUrl)
+    # decode query, queryMore, search and retrieve results with a
+    # RecordSeeder instead of walking an xmltramp tree
+    saxDecoding = False
+    # a describecache.DescribeCache keeping describeSObjects results across
+    # processes
+    describeCache = None
+
+    def __init__(self, serverUrl=None, cacheTypeDescriptions=False,
+                 maxConnections=None, saxDecoding=False, describeCache=None,
+                 compactRecords=False, lazyRecords=False):
+        BaseClient.__init__(self, serverUrl=serverUrl,
+                            maxConnections=maxConnections)
         self.cacheTypeDescriptions = cacheTypeDescriptions
-        if self.cacheTypeDescriptions:
-            self.typeDescs = {}
+        self.saxDecoding = saxDecoding
+        # records are made of compactRecordClass classes rather than
+        # QueryRecords, kept by (type, field names) in recordClasses
+        self.compactRecords = compactRecords
+        self.recordClasses = LRUDict()
+        # records are LazyQueryRecords, unless compactRecords is set
+        self.lazyRecords = lazyRecords
+        self.describeCache = describeCache
+        # also used without cacheTypeDescriptions, so that threads needing
+        # the same type at the same time share a single describe
+        self.typeDescs = TypeDescriptionCache()
+        # (type, field names) -> (type description, plan), a plan is only
+        # used with the description it was compiled from. Like recordClasses
+        # it is bounded, so that it doesn't keep old descriptions alive
+        self.marshallPlans = LRUDict()
+
+    def flushTypeDescriptionsCache(self):
+        self.typeDescs.clear()
+        self.marshallPlans.clear()
+        self.recordClasses.clear()
 
     def login(self, username, passwd):
         res = BaseClient.login(self, username, passwd)
@@ -92,9 +704,10 @@ class Client(BaseClient):
 
     def isConnected(self):
         """ First pass at a method to check if we're connected or not """
-        if self.__conn and self.__conn._HTTPConnection__state == 'Idle':
-            return True
-        return False
+        if not self._serverUrl:
+            return False
+        (scheme, host, path, params, query, frag) = urlparse(self._serverUrl)
+        return self._pool.idleCount(scheme, host) > 0
 
     def describeGlobal(self):
         res = BaseClient.describeGlobal(self)
@@ -141,6 +754,27 @@ class Client(BaseClient):
         return data
 
     def describeSObjects(self, sObjectTypes):
+        if self.describeCache is None:
+            return self._describeSObjects(sObjectTypes)
+        if type(sObjectTypes) not in (TupleType, ListType):
+            sObjectTypes = [sObjectTypes]
+        keys = [describeKey(self._serverUrl, t) for t in sObjectTypes]
+        data = dict()
+        missing = dict()
+        for key, sObjectType in zip(keys, sObjectTypes):
+            if key not in data:
+                data[key] = self.describeCache.get(key)
+                if data[key] is None:
+                    missing[key] = sObjectType
+        if missing:
+            # only describe what isn't cached, in a single call
+            described = self._describeSObjects(missing.values())
+            for key, sObject in zip(missing.keys(), described):
+                self.describeCache.set(key, sObject)
+                data[key] = sObject
+        return [data[key] for key in keys]
+
+    def _describeSObjects(self, sObjectTypes):
         res = BaseClient.describeSObjects(self, sObjectTypes)
         if type(res) not in (TupleType, ListType):
             res = [res]
@@ -148,7 +782,7 @@ class Client(BaseClient):
         for r in res:
             d = dict()
             d['activateable'] = _bool(r[_tPartnerNS.activateable])
-            rawreldata = r[_tPartnerNS.ChildRelationships:]
+            rawreldata = r[_tPartnerNS.childRelationships:]
             relinfo = [_extractChildRelInfo(cr) for cr in rawreldata]
             d['ChildRelationships'] = relinfo
             d['createable'] = _bool(r[_tPartnerNS.createable])
@@ -196,6 +830,9 @@ class Client(BaseClient):
         return data
 
     def create(self, sObjects):
+        return self.__inBatches(self.__create, sObjects)
+
+    def __create(self, sObjects):
         preparedObjects = _prepareSObjects(sObjects)
         res = BaseClient.create(self, preparedObjects)
         if type(res) not in (TupleType, ListType):
@@ -278,17 +915,58 @@ class Client(BaseClient):
         return data
 
     def retrieve(self, fields, sObjectType, ids):
+        if type(ids) not in (TupleType, ListType):
+            ids = [ids]
+        # the type is described while the records are being retrieved
+        describing = self.__describing(sObjectType)
+        if len(ids) <= MAX_RETRIEVE_IDS:
+            data = self.__retrieve(fields, sObjectType, ids, describing)
+            # a single id that doesn't exist gives no records at all
+            if data == [None]:
+                return []
+            return data
+        chunks = [ids[i:i + MAX_RETRIEVE_IDS]
+                  for i in xrange(0, len(ids), MAX_RETRIEVE_IDS)]
+        futures = [self._executor.submit(self.__retrieve, fields,
+                                          sObjectType, chunk, describing)
+                   for chunk in chunks]
+        data = list()
+        for future in futures:
+            data.extend(future.result())
+        return data
+
+    def __describing(self, sObjectType):
+        if self.cacheTypeDescriptions and sObjectType in self.typeDescs:
+            return completed(self._typeDescriptions([sObjectType]))
+        return self._executor.submit(self._typeDescriptions, [sObjectType])
+
+    def __retrieve(self, fields, sObjectType, ids, describing):
+        if self.saxDecoding:
+            def loadTypes(types):
+                typeDescs = dict(describing.result())
+                others = set(types) - set(typeDescs.keys())
+                if others:
+                    typeDescs.update(self._typeDescriptions(others))
+                return typeDescs
+            seeder = RecordSeeder(loadTypes)
+            BaseClient.retrieve(self, fields, sObjectType, ids, seeder)
+            fields = [f.strip() for f in fields.split(',')]
+            return [r is not None and dict([(fname, r[fname])
+                                            for fname in fields]) or None
+                    for r in seeder.decode()]
+
         resultSet = BaseClient.retrieve(self, fields, sObjectType, ids)
-        type_data = self.describeSObjects(sObjectType)[0]
+        type_data = describing.result()[sObjectType]
 
         if type(resultSet) not in (TupleType, ListType):
-            if isnil(resultSet):
-                resultSet = list()
-            else:
-                resultSet = [resultSet]
+            resultSet = [resultSet]
         fields = [f.strip() for f in fields.split(',')]
         data = list()
         for result in resultSet:
+            # the result of an id that doesn't exist (any more) is nil
+            if isnil(result):
+                data.append(None)
+                continue
             d = dict()
             data.append(d)
             for fname in fields:
@@ -296,6 +974,9 @@ class Client(BaseClient):
         return data
 
     def update(self, sObjects):
+        return self.__inBatches(self.__update, sObjects)
+
+    def __update(self, sObjects):
         preparedObjects = _prepareSObjects(sObjects)
         res = BaseClient.update(self, preparedObjects)
         if type(res) not in (TupleType, ListType):
@@ -326,6 +1007,109 @@ class Client(BaseClient):
             types_descs = []
         return dict(map(lambda t, d: (t, d), types, types_descs))
 
+    # the descriptions of types, from the cache unless it is turned off
+    def _typeDescriptions(self, types):
+        return self.typeDescs.getMany(
+            types, self.queryTypesDescriptions,
+            refresh=not self.cacheTypeDescriptions
+        )
+
+    # describing is the Future of descriptions of types the records likely
+    # have, from _describingQuery
+    def _recordSeeder(self, describing=None):
+        loadTypes = self._typeDescriptions
+        if describing is not None:
+            def loadTypes(types):
+                typeDescs = dict(self.__described(describing))
+                others = set(types) - set(typeDescs.keys())
+                if others:
+                    typeDescs.update(self._typeDescriptions(others))
+                return typeDescs
+        return RecordSeeder(loadTypes,
+                            self.compactRecords and self._recordClass or None,
+                            self.lazyRecords)
+
+    def _describingQuery(self, soql):
+        """
+        Start describing the type soql selects from in the background, when
+        type descriptions are cached and that type isn't yet. Returns a
+        Future of a dict of type -> description, or None.
+
+        Queries following relationships aren't described ahead: the types
+        of their records are all described in a single call once they are
+        read, rather than in one call ahead and another after.
+        """
+        if not self.cacheTypeDescriptions:
+            return None
+        try:
+            sObjectType, paths, subqueries = relationships(soql)
+        except ValueError:
+            return None
+        if paths or subqueries or sObjectType in self.typeDescs:
+            return None
+        return self._executor.submit(self.__describeAhead, sObjectType)
+
+    def __describeAhead(self, sObjectType):
+        found = dict()
+        for description in self._typeDescriptions([sObjectType]).values():
+            # keyed by name, as the records have it
+            if description is not None:
+                found[description.name] = description
+        return found
+
+    # the descriptions from describing, or none if it failed
+    def __described(self, describing):
+        if describing is None:
+            return {}
+        try:
+            return describing.result()
+        except Exception:
+            _logger.debug('Describing the types of a query failed',
+                          exc_info=True)
+            return {}
+
+    def _extractRecords(self, xmlRecords, describing=None):
+        # records are extracted in a single pass, looking their types up as
+        # they are met; records of a type that isn't cached yet are put
+        # aside, and extracted once the types of all of them are described
+        # in a single call
+        xmlRecords = list(xmlRecords)
+        records = [None] * len(xmlRecords)
+        typeDescs = _TypeLookup(self)
+        described = self.__described(describing)
+        typeDescs.add(described.keys(), described)
+        pending = range(len(xmlRecords))
+        while pending:
+            deferred = []
+            types = set()
+            for i in pending:
+                try:
+                    records[i] = self._extractRecord(xmlRecords[i], typeDescs)
+                except _Undescribed:
+                    types.update(getRecordTypes(xmlRecords[i]))
+                    deferred.append(i)
+            types -= typeDescs.described
+            if types:
+                typeDescs.add(types, self._typeDescriptions(types))
+            pending = deferred
+        return records
+
+    def _marshallPlan(self, row_type, type_data, names):
+        key = (row_type, names)
+        cached = self.marshallPlans.get(key)
+        if cached is None or cached[0] is not type_data:
+            cached = (type_data, compileMarshallPlan(type_data, names))
+            self.marshallPlans[key] = cached
+        return cached[1]
+
+    def _recordClass(self, row_type, fnames):
+        key = (row_type, fnames)
+        cls = self.recordClasses.get(key)
+        if cls is None:
+            cls = self.recordClasses.setdefault(
+                key, compactRecordClass(row_type, fnames))
+        return cls
+
     def _extractRecord(self, r, typeDescs):
         record = QueryRecord()
         if r:
@@ -333,29 +1117,41 @@ class Client(BaseClient):
             _logger.debug("row type: {0}".format(row_type))
             type_data = typeDescs[row_type]
             _logger.debug("type data: {0}".format(type_data))
-            for field in r:
-                fname = str(field._name[1])
-                if isObject(field):
+            fields = r._dir
+            plan = self._marshallPlan(row_type, type_data,
+                                      tuple([x._name for x in fields]))
+            lazy = False
+            if self.compactRecords:
+                record = self._recordClass(
+                    row_type, tuple([step[0] for step in plan]))()
+            elif self.lazyRecords:
+                record = LazyQueryRecord()
+                lazy = True
+            for i in xrange(len(plan)):
+                fname, first, convert, fieldtype = plan[i]
+                field = fields[i]
+                xsiType = field._attrs.get(_xsiType)
+                if xsiType == 'sf:sObject':
                     record[fname] = self._extractRecord(
-                        r[field._name:][0], typeDescs
+                        fields[first], typeDescs
                     )
-                elif isQueryResult(field):
+                elif xsiType == 'QueryResult':
                     record[fname] = QueryRecordSet(
                         records=[self._extractRecord(rec, typeDescs) for rec
                                  in field[_tPartnerNS.records:]],
-                        done=field[_tPartnerNS.done],
+                        done=_bool(field[_tPartnerNS.done]),
                         size=int(str(field[_tPartnerNS.size]))
                     )
+                elif lazy and convert is not None and \
+                        fieldtype not in eagertypes:
+                    record[fname] = LazyValue(convert, fields[first])
+                elif convert is not None:
+                    record[fname] = convert(nodeText(fields[first]))
                 else:
-                    record[fname] = type_data.marshall(fname, r)
+                    record[fname] = marshall(fieldtype, fname, r)
         return record
 
     def query(self, *args, **kw):
-        if self.cacheTypeDescriptions:
-            typeDescs = self.typeDescs
-        else:
-            typeDescs = {}
-
         if len(args) == 1:  # full query string
             queryString = args[0]
         elif len(args) == 2:  # BBB: fields, sObjectType
@@ -374,39 +1170,59 @@ class Client(BaseClient):
         else:
             raise RuntimeError("Wrong number of arguments to query method.")
 
-        res = BaseClient.query(self, queryString)
-        # calculate the union of the sets of record types from each record
-        types = reduce(lambda a, b: a | b, [getRecordTypes(r) for r in
-                                        res[_tPartnerNS.records:]], set())
-        new_types = types - set(typeDescs.keys())
-        if new_types:
-            typeDescs.update(self.queryTypesDescriptions(new_types))
+        # the types are described while the query runs
+        describing = self._describingQuery(queryString)
+        if self.saxDecoding:
+            seeder = self._recordSeeder(describing)
+            res = BaseClient.query(self, queryString, seeder)
+            records = seeder.decode()
+        else:
+            res = BaseClient.query(self, queryString)
+            records = self._extractRecords(res[_tPartnerNS.records:],
+                                           describing)
         data = QueryRecordSet(
-            records=[self._extractRecord(r, typeDescs) for r in
-                     res[_tPartnerNS.records:]],
+            records=records,
             done=_bool(res[_tPartnerNS.done]),
             size=int(str(res[_tPartnerNS.size])),
             queryLocator=str(res[_tPartnerNS.queryLocator])
         )
         return data
 
-    def queryMore(self, queryLocator):
-        if self.cacheTypeDescriptions:
-            typeDescs = self.typeDescs
-        else:
-            typeDescs = {}
+    def query_lazy(self, soql, maxPages=LAZY_PAGES):
+        """
+        Run soql, returning a LazyQueryRecordSet of all the records it
+        matches, that fetches the pages after the first one on access.
+        """
+        return LazyQueryRecordSet(self, self.query(soql), maxPages)
+
+    def query_columnar(self, soql, prefetch=1, partitions=1):
+        """
+        Run soql, returning all the records it matches as a
+        columnar.ColumnarRecordSet, which holds numbers and dates in arrays
+        rather than in a dict per record.
+        """
+        from columnar import queryColumnar  # columnar imports this module
+        return queryColumnar(self, soql, prefetch, partitions)
 
+    def _pageRecords(self, page):
+        return page
+
+    def _nextPage(self, page):
+        if page.done:
+            return None
+        return page.queryLocator
+
+    def queryMore(self, queryLocator):
         locator = queryLocator
-        res = BaseClient.queryMore(self, locator)
-        # calculate the union of the sets of record types from each record
-        types = reduce(lambda a, b: a | b, [getRecordTypes(r) for r in
-                       res[_tPartnerNS.records:]], set())
-        new_types = types - set(typeDescs.keys())
-        if new_types:
-            typeDescs.update(self.queryTypesDescriptions(new_types))
+        if self.saxDecoding:
+            seeder = self._recordSeeder()
+            res = BaseClient.queryMore(self, locator, seeder)
+            records = seeder.decode()
+        else:
+            res = BaseClient.queryMore(self, locator)
+            records = self._extractRecords(res[_tPartnerNS.records:])
         data = QueryRecordSet(
-            records=[self._extractRecord(r, typeDescs) for r in
-                     res[_tPartnerNS.records:]],
+            records=records,
             done=_bool(res[_tPartnerNS.done]),
             size=int(str(res[_tPartnerNS.size])),
             queryLocator=str(res[_tPartnerNS.queryLocator])
@@ -414,25 +1230,22 @@ class Client(BaseClient):
         return data
 
     def search(self, sosl):
-        if self.cacheTypeDescriptions:
-            typeDescs = self.typeDescs
-        else:
-            typeDescs = {}
+        if self.saxDecoding:
+            seeder = self._recordSeeder()
+            BaseClient.search(self, sosl, seeder)
+            return seeder.decode()
         res = BaseClient.search(self, sosl)
 
-        # calculate the union of the sets of record types from each record
         if len(res):
-            types = reduce(lambda a, b: a | b, [getRecordTypes(r) for r in
-                           res[_tPartnerNS.searchRecords]], set())
-            new_types = types - set(typeDescs.keys())
-            if new_types:
-                typeDescs.update(self.queryTypesDescriptions(new_types))
-            return [self._extractRecord(r, typeDescs) for r in
-                    res[_tPartnerNS.searchRecords]]
+            return self._extractRecords([r[_tPartnerNS.record] for r in
+                                         res[_tPartnerNS.searchRecords:]])
         else:
             return []
 
     def delete(self, ids):
+        return self.__inBatches(self.__delete, ids)
+
+    def __delete(self, ids):
         res = BaseClient.delete(self, ids)
         if type(res) not in (TupleType, ListType):
             res = [res]
@@ -450,6 +1263,10 @@ class Client(BaseClient):
         return data
 
     def upsert(self, externalIdName, sObjects):
+        return self.__inBatches(self.__upsert, sObjects, externalIdName,
+                                created=False)
+
+    def __upsert(self, sObjects, externalIdName):
         preparedObjects = _prepareSObjects(sObjects)
         res = BaseClient.upsert(self, externalIdName, preparedObjects)
         if type(res) not in (TupleType, ListType):
@@ -468,6 +1285,39 @@ class Client(BaseClient):
             d['isCreated'] = d['created'] = _bool(r[_tPartnerNS.created])
         return data
 
+    def __inBatches(self, save, items, *args, **failed):
+        """
+        Call save(batch, *args) for batches of at most MAX_SAVE_BATCH items,
+        concurrently, and return the results in the order of items.
+
+        A batch failing as a whole, e.g. on a SOAP fault, only fails the
+        results of its own items, with an error holding the exception and
+        any extra failed values. Small inputs are saved in a single call
+        that raises as before, and a SessionTimeoutError always raises.
+        """
+        if (type(items) not in (TupleType, ListType) or
+                len(items) <= MAX_SAVE_BATCH):
+            return save(items, *args)
+        batches = [items[i:i + MAX_SAVE_BATCH]
+                   for i in xrange(0, len(items), MAX_SAVE_BATCH)]
+        futures = [self._executor.submit(save, batch, *args)
+                   for batch in batches]
+        data = list()
+        timedOut = None
+        for batch, future in zip(batches, futures):
+            error = future.exception()
+            if error is None:
+                data.extend(future.result())
+                continue
+            if isinstance(error, SessionTimeoutError):
+                timedOut = timedOut or future
+            _logger.warning('Batch of {0} failed: {1}'.format(len(batch),
+                                                               error))
+            data.extend([_batchError(error, **failed) for item in batch])
+        if timedOut is not None:
+            timedOut.result()
+        return data
+
     def getDeleted(self, sObjectType, start, end):
         res = BaseClient.getDeleted(self, sObjectType, start, end)
         res = res[_tPartnerNS.deletedRecords:]
@@ -599,6 +1449,10 @@ def _extractFieldInfo(fdata):
     data['picklistValues'] = [_extractPicklistEntry(p) for p in plValues]
     data['precision'] = int(str(fdata[_tPartnerNS.precision]))
     data['referenceTo'] = [str(r) for r in fdata[_tPartnerNS.referenceTo:]]
+    try:
+        data['relationshipName'] = str(fdata[_tPartnerNS.relationshipName])
+    except KeyError:
+        data['relationshipName'] = ''
     data['restrictedPicklist'] = _bool(fdata[_tPartnerNS.restrictedPicklist])
     data['scale'] = int(str(fdata[_tPartnerNS.scale]))
     data['soapType'] = str(fdata[_tPartnerNS.soapType])
@@ -628,6 +1482,10 @@ def _extractChildRelInfo(crdata):
     data['cascadeDelete'] = _bool(crdata[_tPartnerNS.cascadeDelete])
     data['childSObject'] = str(crdata[_tPartnerNS.childSObject])
     data['field'] = str(crdata[_tPartnerNS.field])
+    try:
+        data['relationshipName'] = str(crdata[_tPartnerNS.relationshipName])
+    except KeyError:
+        data['relationshipName'] = ''
     return data
 
 
@@ -650,6 +1508,18 @@ def _extractError(edata):
     return data
 
 
+def _batchError(error, **failed):
+    data = dict(id='', success=False, errors=[dict(
+        statusCode=getattr(error, 'faultCode', error.__class__.__name__),
+        message=getattr(error, 'faultString', str(error)),
+        fields=list()
+    )])
+    data.update(failed)
+    if 'created' in failed:
+        data['isCreated'] = failed['created']
+    return data
+
+
 def _extractTab(tdata):
     data = dict(
         custom=_bool(tdata[_tPartnerNS.custom]),
@@ -0,0 +1,182 @@
+'''Helpers to take SOQL statements apart and add conditions to them'''
+import datetime
+import re
+
+# string literals, parentheses and words, the tokens that matter to find
+# the clauses of a statement
+_tokens = re.compile(r"'(?:[^'\\]|\\.)*'|\(|\)|[\w.]+")
+_clauses = ('where', 'with', 'group', 'order', 'limit', 'offset', 'for')
+_dateValue = re.compile(r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2}(\.\d+)?Z?)?$')
+
+
+# (start, end, lowercased word) of the words of soql outside of any
+# subquery, function call or string literal
+def _topLevelWords(soql):
+    depth = 0
+    for m in _tokens.finditer(soql):
+        token = m.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token[0] != "'":
+            yield m.start(), m.end(), token.lower()
+
+
+def clauses(soql):
+    """
+    Split soql into a dict of its top level clauses: 'select' (the select
+    list), 'from' (the sObject type and anything up to the next clause),
+    then 'where', 'with', 'group', 'order', 'limit', 'offset' and 'for'
+    when present, each value without its keyword(s).
+    """
+    marks = []
+    for start, end, word in _topLevelWords(soql):
+        if word == 'select' and not marks:
+            marks.append(('select', start, end))
+        elif word == 'from' and len(marks) == 1:
+            marks.append(('from', start, end))
+        elif word in _clauses and len(marks) > 1:
+            if word in ('group', 'order'):
+                match = re.match(r'\s*by\b', soql[end:], re.I)
+                if match is None:
+                    continue
+                end += match.end()
+            marks.append((word, start, end))
+    if len(marks) < 2:
+        raise ValueError('Not a SOQL query: %r' % soql)
+    parts = dict()
+    for i, (name, start, end) in enumerate(marks):
+        stop = i + 1 < len(marks) and marks[i + 1][1] or len(soql)
+        parts[name] = soql[end:stop].strip()
+    return parts
+
+
+def selectItems(select):
+    """The items of a select list, split at its top level commas."""
+    items = []
+    depth = start = 0
+    for i, c in enumerate(select):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(select[start:i].strip())
+            start = i + 1
+    items.append(select[start:].strip())
+    return [item for item in items if item]
+
+
+def selectList(soql):
+    """
+    What soql selects, as (items, sObject type, alias): the items of its
+    select list, the type of its FROM clause and the lowercased alias given
+    to that type, or None.
+    """
+    parts = clauses(soql)
+    words = parts['from'].split()
+    alias = None
+    if len(words) > 1 and words[1].lower() != 'using':
+        alias = words[1].lower()
+    return selectItems(parts['select']), words[0], alias
+
+
+def selectObject(soql):
+    """The sObject type soql selects from."""
+    return selectList(soql)[1]
+
+
+def relationships(soql):
+    """
+    What soql reads, as (sObject type, parent paths, child subqueries): the
+    type of its FROM clause, the relationship names leading to the fields of
+    its select list, e.g. ('Account', 'Owner') for Account.Owner.Name, and
+    the (relationship name, subquery) pairs of its child relationship
+    subqueries. Functions and TYPEOF expressions are left out.
+    """
+    items, sObjectType, alias = selectList(soql)
+    sObjectType = sObjectType.split('.')[-1]
+    paths = []
+    subqueries = []
+    for item in items:
+        if item.startswith('('):
+            inner = item[1:-1].strip()
+            name = selectObject(inner).split('.')[-1]
+            subqueries.append((name, inner))
+        elif '(' not in item and len(item.split()) == 1:
+            names = item.split('.')
+            if names[0].lower() == alias:
+                names = names[1:]
+            path = tuple(names[:-1])
+            if path and path not in paths:
+                paths.append(path)
+    return sObjectType, paths, subqueries
+
+
+def addCondition(soql, condition):
+    """soql with condition ANDed to its WHERE clause, or as a new one."""
+    for start, end, word in _topLevelWords(soql):
+        if word == 'where':
+            following = [s for s, e, w in _topLevelWords(soql[end:])
+                         if w in _clauses[1:]]
+            stop = following and end + following[0] or len(soql)
+            return '%s (%s) AND (%s) %s' % (
+                soql[:end], soql[end:stop].strip(), condition,
+                soql[stop:].strip())
+    seenFrom = False
+    for start, end, word in _topLevelWords(soql):
+        if word == 'from':
+            seenFrom = True
+        elif seenFrom and word in _clauses:
+            return '%sWHERE %s %s' % (soql[:start], condition, soql[start:])
+    return '%s WHERE %s' % (soql.rstrip(), condition)
+
+
+def literal(value):
+    """The SOQL literal of the text value of a field."""
+    if _dateValue.match(value):
+        return value
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def rangeConditions(field, bounds):
+    """
+    Conditions splitting the values of field into len(bounds) + 1 disjoint
+    ranges at bounds, a non empty list of sorted field values. Records
+    with a null field match none of them.
+    """
+    bounds = [literal(b) for b in bounds]
+    conditions = ['%s < %s' % (field, bounds[0])]
+    for low, high in zip(bounds, bounds[1:]):
+        conditions.append('%s >= %s AND %s < %s' % (field, low, field, high))
+    conditions.append('%s >= %s' % (field, bounds[-1]))
+    return conditions
+
+
+def dateBounds(low, high, count):
+    """
+    Up to count - 1 dates or datetimes, as SOQL text, evenly splitting the
+    range from low to high, also SOQL text. Bounds are whole seconds or
+    days, those not strictly between low and high would only make empty
+    ranges and are left out.
+    """
+    lowText, highText = low, high
+    if 'T' in low:
+        format = '%Y-%m-%dT%H:%M:%S'
+        low = datetime.datetime.strptime(low[:19], format)
+        high = datetime.datetime.strptime(high[:19], format)
+        suffix = '.000Z'
+    else:
+        format = '%Y-%m-%d'
+        low = datetime.datetime.strptime(low, format)
+        high = datetime.datetime.strptime(high, format)
+        suffix = ''
+    step = (high - low) / count
+    bounds = []
+    for i in xrange(1, count):
+        bound = (low + step * i).strftime(format) + suffix
+        # values as the API returns them sort like their text
+        if lowText < bound < highText and (not bounds or bound != bounds[-1]):
+            bounds.append(bound)
+    return bounds
@@ -1,5 +1,11 @@
 from types import DictType, StringTypes, IntType, ListType, TupleType
+from StringIO import StringIO
+from xml.sax.saxutils import XMLGenerator, quoteattr
+import copy
 import gc
+import gzip
+import socket
+import sys
 import unittest
 import datetime
 from time import time
@@ -8,6 +14,15 @@ import sfconfig
 import pyforce
 
 from pyforce import SoapFaultError
+from pyforce import xmltramp
+from pyforce.xmltramp import islst
+from pyforce.pyforce import SObject, Field, QueryRecord
+from pyforce.columnar import ColumnarRecordSet
+from pyforce.export import selectColumns
+from pyforce import marshall
+from pyforce import xmlclient
+from pyforce.executor import Executor
+from pyforce.xmlclient import _tPartnerNS
 
 BENCHMARK_REPS = 1
 def benchmark(func):
@@ -34,11 +49,7 @@ class TestUtils(unittest.TestCase):
         svc = self.svc
         ids = self._todelete
         if ids:
-            while len(ids) > 200:
-                svc.delete(ids[:200])
-                ids = ids[200:]
-            if ids:
-                svc.delete(ids)
+            svc.delete(ids)
         self._todelete = list()
 
     @benchmark
@@ -107,9 +118,539 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(res['records'][0]['Id'], janeid)
         self.tearDown()
 
+# a query result of nrecords records of a custom object with nfields
+# string fields, and the matching type description
+def wideQueryResult(nrecords, nfields):
+    fields = ''.join(['<sf:Field%d__c>value %d</sf:Field%d__c>' % (i, i, i)
+                      for i in xrange(nfields)])
+    records = ''.join(['<records xsi:type="sf:sObject"><sf:type>Wide__c'
+                       '</sf:type><sf:Id>a00000000000%03dAAA</sf:Id>%s'
+                       '</records>' % (n % 1000, fields)
+                       for n in xrange(nrecords)])
+    return ('<result xmlns="urn:partner.soap.sforce.com" '
+            'xmlns:sf="urn:sobject.partner.soap.sforce.com" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<done>true</done><queryLocator xsi:nil="true"/>%s'
+            '<size>%d</size></result>' % (records, nrecords))
+
+def wideTypeDescs(nfields):
+    fields = dict([('Field%d__c' % i, Field(name='Field%d__c' % i,
+                                            type='string'))
+                   for i in xrange(nfields)])
+    fields['Id'] = Field(name='Id', type='id')
+    return {'Wide__c': SObject(name='Wide__c', fields=fields)}
+
+# a query result of nrecords records with datetime, double, date and
+# multipicklist fields, cycling through nfields of them
+typedValues = [('datetime', '2015-12-01T10:11:12.000Z'), ('double', '12.5'),
+               ('date', '2015-12-01'), ('multipicklist', 'Apple;Pear')]
+
+def typedQueryResult(nrecords, nfields):
+    fields = ''.join(['<sf:Field%d__c>%s</sf:Field%d__c>' % (
+        i, typedValues[i % 4][1], i) for i in xrange(nfields)])
+    return wideQueryResult(nrecords, 0).replace(
+        '</sf:Id>', '</sf:Id>' + fields)
+
+def typedTypeDescs(nfields):
+    fields = dict([('Field%d__c' % i, Field(name='Field%d__c' % i,
+                                            type=typedValues[i % 4][0]))
+                   for i in xrange(nfields)])
+    fields['Id'] = Field(name='Id', type='id')
+    return {'Wide__c': SObject(name='Wide__c', fields=fields)}
+
+# a query result of nrecords Accounts, each with its Owner and a subquery
+# of ncontacts Contacts, each with its Account, like
+# SELECT Id, Name, Owner.Name, (SELECT FirstName, Account.Site FROM Contacts)
+# FROM Account
+def nestedQueryResult(nrecords, ncontacts):
+    contact = ('<records xsi:type="sf:sObject"><sf:type>Contact</sf:type>'
+               '<sf:Id xsi:nil="true"/><sf:FirstName>First %d</sf:FirstName>'
+               '<sf:Account xsi:type="sf:sObject"><sf:type>Account</sf:type>'
+               '<sf:Id xsi:nil="true"/><sf:Site>www.site.com</sf:Site>'
+               '</sf:Account></records>')
+    contacts = ''.join([contact % i for i in xrange(ncontacts)])
+    records = ''.join(['<records xsi:type="sf:sObject"><sf:type>Account'
+                       '</sf:type><sf:Id>001000000000%03dAAA</sf:Id>'
+                       '<sf:Name>Account %d</sf:Name><sf:Owner '
+                       'xsi:type="sf:sObject"><sf:type>User</sf:type>'
+                       '<sf:Id xsi:nil="true"/><sf:Name>Owner</sf:Name>'
+                       '</sf:Owner><sf:Contacts xsi:type="QueryResult">'
+                       '<done>true</done><queryLocator xsi:nil="true"/>%s'
+                       '<size>%d</size></sf:Contacts></records>' % (
+                           n % 1000, n, contacts, ncontacts)
+                       for n in xrange(nrecords)])
+    return ('<result xmlns="urn:partner.soap.sforce.com" '
+            'xmlns:sf="urn:sobject.partner.soap.sforce.com" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<done>true</done><queryLocator xsi:nil="true"/>%s'
+            '<size>%d</size></result>' % (records, nrecords))
+
+def nestedTypeDescs():
+    fields = dict(Account=['Id', 'Name', 'Site'], User=['Id', 'Name'],
+                  Contact=['Id', 'FirstName'])
+    return dict([(t, SObject(name=t, fields=dict([
+        (f, Field(name=f, type=f == 'Id' and 'id' or 'string'))
+        for f in names]))) for t, names in fields.items()])
+
+# a retrieve result of an Attachment with a Body of size bytes, base64
+# encoded in lines of 76 characters, so SAX hands it over line by line
+def attachmentResult(size):
+    body = ('0123456789abcdef' * (size / 16 + 1))[:size].encode('base64')
+    return ('<result xmlns="urn:partner.soap.sforce.com" '
+            'xmlns:sf="urn:sobject.partner.soap.sforce.com" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:type="sf:sObject"><sf:type>Attachment</sf:type>'
+            '<sf:Id>00P000000000001AAA</sf:Id><sf:Name>data.bin</sf:Name>'
+            '<sf:Body>%s</sf:Body></result>' % body)
+
+# the character data accumulation of earlier releases, for comparison
+class ConcatenatingSeeder(xmltramp.Seeder):
+    def __init__(self):
+        xmltramp.Seeder.__init__(self)
+        self.ch = ''
+
+    def flushCharacters(self):
+        ch = self.ch
+        self.ch = ''
+        if ch and not ch.isspace():
+            self.stack[-1]._dir.append(ch)
+
+    def characters(self, ch):
+        self.ch += ch
+
+# the linear scan of the children that xmltramp elements always did, before
+# they could be indexed by name
+class ScanningElement(xmltramp.Element):
+    def _children(self, n, first=False):
+        found = []
+        for x in self._dir:
+            if isinstance(x, xmltramp.Element) and x._name == n:
+                found.append(x)
+                if first:
+                    break
+        return found
+
+class ScanningSeeder(xmltramp.Seeder):
+    def startElementNS(self, name, qname, attrs):
+        xmltramp.Seeder.startElementNS(self, name, qname, attrs)
+        self.stack[-1].__class__ = ScanningElement
+
+class TestDecoding(unittest.TestCase):
+    """Offline benchmarks of response decoding, these need no login."""
+
+    def setUp(self):
+        self.svc = pyforce.PythonClient()
+
+    @benchmark
+    def testExtractWideRecords(self):
+        response = wideQueryResult(200, 200)
+        typeDescs = wideTypeDescs(200)
+        # extraction only looks the type up by name, the first child, so
+        # elements aren't indexed and should time the same as scanning
+        for name, seeder in (('scanned', ScanningSeeder),
+                             ('xmltramp', xmltramp.Seeder)):
+            result = xmltramp.parse(response, seeder())
+            t0 = time()
+            records = [self.svc._extractRecord(r, typeDescs)
+                       for r in result[_tPartnerNS.records:]]
+            print "\n%s children, 200 records of 201 fields: %.3f" % (
+                name, time() - t0)
+            self.assertEqual(len(records), 200)
+            self.assertEqual(records[-1]['Field199__c'], 'value 199')
+
+    @benchmark
+    def testMarshallWideRecordsByName(self):
+        # how the DOM retrieve path marshalls fields, looking each one up by
+        # name, which is when elements get indexed
+        response = wideQueryResult(50, 200)
+        type_data = wideTypeDescs(200)['Wide__c']
+        fields = ['Field%d__c' % i for i in xrange(200)]
+        for name, seeder in (('scanned', ScanningSeeder),
+                             ('xmltramp', xmltramp.Seeder)):
+            result = xmltramp.parse(response, seeder())
+            t0 = time()
+            records = [dict([(f, type_data.marshall(f, r)) for f in fields])
+                       for r in result[_tPartnerNS.records:]]
+            print "\n%s children, 50 records of 200 fields by name: %.3f" % (
+                name, time() - t0)
+            self.assertEqual(records[-1]['Field199__c'], 'value 199')
+
+    @benchmark
+    def testExtractWideCompactRecords(self):
+        result = xmltramp.parse(wideQueryResult(200, 200))
+        typeDescs = wideTypeDescs(200)
+        self.svc.compactRecords = True
+        records = [self.svc._extractRecord(r, typeDescs)
+                   for r in result[_tPartnerNS.records:]]
+        self.assertEqual(len(records), 200)
+        self.assertEqual(records[-1].Field199__c, 'value 199')
+        self.svc.compactRecords = False
+        plain = self.svc._extractRecord(result[_tPartnerNS.records], typeDescs)
+        self.assertEqual(records[0], plain)
+        print "\nrecord of 201 fields: %d bytes as a dict, %d compact" % (
+            sys.getsizeof(plain), sys.getsizeof(records[0]))
+
+    @benchmark
+    def testExtractLazyRecords(self):
+        result = xmltramp.parse(typedQueryResult(1000, 40))
+        typeDescs = typedTypeDescs(40)
+        for lazy in (False, True):
+            self.svc.lazyRecords = lazy
+            t0 = time()
+            records = [self.svc._extractRecord(r, typeDescs)
+                       for r in result[_tPartnerNS.records:]]
+            used = [(r.Field0__c, r.Field1__c) for r in records]
+            print "\nlazyRecords=%s, reading 2 of 41 fields: %.3f" % (
+                lazy, time() - t0)
+        self.svc.lazyRecords = False
+        self.assertEqual(used[-1], (datetime.datetime(2015, 12, 1, 10, 11, 12),
+                                    12.5))
+        self.assertEqual(records[-1]['Field3__c'], ['Apple', 'Pear'])
+
+    @benchmark
+    def testDateTimeConverters(self):
+        n = 20000
+        start = datetime.datetime(2015, 12, 1)
+        texts = [(start + datetime.timedelta(seconds=i)).strftime(
+            '%Y-%m-%dT%H:%M:%S.000Z') for i in xrange(n)]
+        # the general parse, as used for the text of any offset
+        offsetTexts = [t.replace('Z', '+00:00') for t in texts]
+        repeated = texts[:50] * (n / 50)
+        for name, values in (('regex', offsetTexts), ('sliced', texts),
+                             ('memoized', repeated)):
+            marshall._dateTimeMemos[False].clear()
+            t0 = time()
+            converted = [marshall.dateTimeConverter(v) for v in values]
+            print "\n%s: %.2f us per datetime" % (
+                name, (time() - t0) * 1e6 / len(values))
+            self.assertEqual(converted[49], start + datetime.timedelta(
+                seconds=49))
+
+    @benchmark
+    def testExtractNestedRecords(self):
+        result = xmltramp.parse(nestedQueryResult(500, 10))
+        xmlRecords = result[_tPartnerNS.records:]
+        typeDescs = nestedTypeDescs()
+        self.svc.cacheTypeDescriptions = True
+        self.svc.typeDescs.getMany(typeDescs.keys(), lambda types: typeDescs)
+        # the types of all the records first, then the records
+        t0 = time()
+        types = reduce(lambda a, b: a | b,
+                       [pyforce.pyforce.getRecordTypes(r) for r in xmlRecords])
+        described = self.svc._typeDescriptions(types)
+        expected = [self.svc._extractRecord(r, described) for r in xmlRecords]
+        print "\ntwo passes over 500 Accounts of 10 Contacts: %.3f" % (
+            time() - t0)
+        t0 = time()
+        records = self.svc._extractRecords(xmlRecords)
+        print "one pass: %.3f" % (time() - t0)
+        self.assertEqual(records, expected)
+        self.assertEqual(records[-1].Contacts[-1].Account.Site,
+                         'www.site.com')
+        self.assertEqual(records[-1].Owner.Name, 'Owner')
+
+    @benchmark
+    def testParseAttachmentBody(self):
+        typeDescs = {'Attachment': SObject(name='Attachment', fields=dict(
+            Id=Field(name='Id', type='id'),
+            Name=Field(name='Name', type='string'),
+            Body=Field(name='Body', type='base64')))}
+        # concatenation is quadratic, it only gets a quarter of a megabyte
+        for name, seeder, size in (
+                ('concatenated', ConcatenatingSeeder, 256 * 1024),
+                ('joined', xmltramp.Seeder, 256 * 1024),
+                ('joined', xmltramp.Seeder, 4 * 1024 * 1024)):
+            response = attachmentResult(size)
+            t0 = time()
+            result = xmltramp.parse(response, seeder())
+            record = self.svc._extractRecord(result, typeDescs)
+            print "\n%s text, %d KB Body: %.3f" % (
+                name, size / 1024, time() - t0)
+            body = record['Body'].decode('base64')
+            self.assertEqual(len(body), size)
+            self.assertEqual(body[-16:], '0123456789abcdef')
+
+    @benchmark
+    def testColumnarNumericRecords(self):
+        n = 100000
+        records = [QueryRecord(type='Opportunity', Amount=i * 1.5,
+                               Probability=float(i % 100), IsWon=i % 2 == 0,
+                               CloseDate=datetime.date(2015, 1, 1 + i % 28),
+                               TotalOpportunityQuantity=i) for i in xrange(n)]
+        columns = ColumnarRecordSet(selectColumns(
+            'SELECT Amount, Probability, IsWon, CloseDate, '
+            'TotalOpportunityQuantity FROM Opportunity'))
+        for record in records:
+            columns.append(record)
+        self.assertEqual(len(columns), n)
+        self.assertEqual(columns.row(n - 1), dict([(k, v) for k, v in
+                         records[-1].items() if k != 'type']))
+        asRecords = sum([sys.getsizeof(r) + sum([sys.getsizeof(v) for v in
+                                                 r.values()])
+                         for r in records])
+        asColumns = sum([c.values.itemsize * len(c.values) + len(c.nulls)
+                         for c in columns.columns])
+        print "\n%d records: %d bytes as dicts, %d as columns" % (
+            n, asRecords, asColumns)
+
+class BeatBoxXmlGenerator(XMLGenerator):
+    def __init__(self, destination, encoding):
+        XMLGenerator.__init__(self, destination, encoding)
+
+        if hasattr(self, '_out') and self._out:
+            self._write = self._out.write
+            self._flush = self._out.flush
+
+    def makeName(self, name):
+        if name[0] is None:
+            #if the name was not namespace-scoped, use the qualified part
+            return name[1]
+        # else try to restore the original prefix from the namespace
+        return self._current_context[name[0]] + ":" + name[1]
+
+    def startElementNS(self, name, qname, attrs):
+        self._write(unicode('<' + self.makeName(name)))
+
+        for pair in self._undeclared_ns_maps:
+            self._write(unicode(' xmlns:%s="%s"' % pair))
+        self._undeclared_ns_maps = []
+
+        for (name, value) in attrs.items():
+            self._write(unicode(' %s=%s' % (
+                self.makeName(name),
+                quoteattr(value)))
+            )
+        self._write(unicode('>'))
+
+# the writer of earlier releases, writing through XMLGenerator
+class XmlWriter(object):
+    def __init__(self, doGzip):
+        self.__buf = StringIO("")
+        if doGzip:
+            self.__gzip = gzip.GzipFile(mode='wb', fileobj=self.__buf)
+            stm = self.__gzip
+        else:
+            stm = self.__buf
+            self.__gzip = None
+        self.xg = BeatBoxXmlGenerator(stm, "utf-8")
+        self.xg.startDocument()
+        self.__elems = []
+
+    def startPrefixMapping(self, prefix, namespace):
+        self.xg.startPrefixMapping(prefix, namespace)
+
+    def endPrefixMapping(self, prefix):
+        self.xg.endPrefixMapping(prefix)
+
+    def startElement(self, namespace, name, attrs=xmlclient._noAttrs):
+        self.xg.startElementNS((namespace, name), name, attrs)
+        self.__elems.append((namespace, name))
+
+    # General Function for writing an XML Element.
+    # Detects the type of the element, and handles each type appropriately.
+    # i.e. If a list, then it encodes each element, if a dict, it writes an
+    # embedded element.
+    def writeElement(self, namespace, name, value, attrs=xmlclient._noAttrs):
+        if islst(value):
+            for v in value:
+                self.writeElement(namespace, name, v, attrs)
+        elif isinstance(value, dict):
+            self.startElement(namespace, name, attrs)
+            if 'type' in value:
+                # Type must always come first, even in embedded objects.
+                type_entry = value['type']
+                self.writeElement(namespace, 'type', type_entry, attrs)
+                del value['type']
+            for k, v in value.items():
+                self.writeElement(namespace, k, v, attrs)
+            self.endElement()
+        else:
+            self.startElement(namespace, name, attrs)
+            self.characters(value)
+            self.endElement()
+
+    def endElement(self):
+        e = self.__elems[-1]
+        self.xg.endElementNS(e, e[1])
+        del self.__elems[-1]
+
+    def characters(self, s):
+        # todo base64 ?
+        if isinstance(s, datetime.datetime) or isinstance(s, datetime.date):
+            s = s.isoformat()
+        elif isinstance(s, (int, float, long)):
+            s = str(s)
+        self.xg.characters(s)
+
+    def endDocument(self):
+        self.xg.endDocument()
+        if (self.__gzip != None):
+            self.__gzip.close()
+        return self.__buf.getvalue()
+
+# the SoapWriter of earlier releases
+class GeneratorSoapWriter(XmlWriter):
+    def __init__(self):
+        XmlWriter.__init__(self, xmlclient.gzipRequest)
+        self.startPrefixMapping("s", xmlclient._envNs)
+        self.startPrefixMapping("p", xmlclient._partnerNs)
+        self.startPrefixMapping("o", xmlclient._sobjectNs)
+        self.startPrefixMapping("x", xmlclient._schemaInstanceNs)
+        self.startElement(xmlclient._envNs, "Envelope")
+
+    def endDocument(self):
+        self.endElement()  # envelope
+        for prefix in ("x", "o", "p", "s"):
+            self.endPrefixMapping(prefix)
+        return XmlWriter.endDocument(self)
+
+# a retrieve whose headers are rendered for every envelope
+class UncachedRetrieveRequest(xmlclient.RetrieveRequest):
+    def headerKey(self):
+        return None
+
+# a create whose headers are rendered for every envelope, by any writer
+class UncachedCreateRequest(xmlclient.CreateRequest):
+    def headerKey(self):
+        return None
+
+# connections whose first failures requests fail, then answer a create
+class FlakyConnection(object):
+    failures = 0
+    bodies = []
+
+    def request(self, method, path, body, headers):
+        FlakyConnection.bodies.append(body)
+        if FlakyConnection.failures:
+            FlakyConnection.failures -= 1
+            raise socket.error('connection reset')
+
+    def getresponse(self):
+        return FlakyResponse()
+
+    def close(self):
+        pass
+
+class FlakyResponse(object):
+    def read(self):
+        return ('<s:Envelope xmlns:s="%s" xmlns="%s"><s:Body><createResponse>'
+                '<result><id>003000000000001AAA</id><success>true</success>'
+                '</result></createResponse></s:Body></s:Envelope>' % (
+                    xmlclient._envNs, xmlclient._partnerNs))
+
+    def getheader(self, name, default=None):
+        return default
+
+class FlakyPool(xmlclient.ConnectionPool):
+    def checkout(self, scheme, host):
+        return FlakyConnection()
+
+    def checkin(self, scheme, host, conn):
+        pass
+
+    def discard(self, scheme, host, conn):
+        pass
+
+# a create counting its serializations
+class CountingCreateRequest(xmlclient.CreateRequest):
+    def makeEnvelope(self):
+        self.serialized = getattr(self, 'serialized', 0) + 1
+        return xmlclient.CreateRequest.makeEnvelope(self)
+
+class TestEncoding(unittest.TestCase):
+    """Offline benchmarks of request encoding, these need no login."""
+
+    def setUp(self):
+        self.gzipRequest = xmlclient.gzipRequest
+        self.soapWriter = xmlclient.SoapWriter
+        xmlclient.gzipRequest = False
+
+    def tearDown(self):
+        xmlclient.gzipRequest = self.gzipRequest
+        xmlclient.SoapWriter = self.soapWriter
+
+    @benchmark
+    def testCreateEnvelope(self):
+        sObjects = [dict(type='Contact', LastName=u'Doe \xe9 %d' % i,
+                         FirstName='John & Jane', Phone='123-456-7890',
+                         Email='john@doe.com', NumberOfEmployees__c=i,
+                         Amount__c=i * 1.5, HasOptedOutOfEmail=False,
+                         Birthdate=datetime.date(1970, 1, 4),
+                         Favorite_Fruit__c='Apple;Pear',
+                         MailingAddress={'type': 'Address', 'city': 'Town'},
+                         fieldsToNull=['Title', 'Department'])
+                    for i in xrange(200)]
+        envelopes = []
+        # XMLGenerator last, as its writeElement drops the type of dicts, and
+        # with a copy of the records per envelope; it can't cache headers
+        for name, writer, request in (
+                ('buffered', self.soapWriter, xmlclient.CreateRequest),
+                ('XMLGenerator', GeneratorSoapWriter, UncachedCreateRequest)):
+            xmlclient.SoapWriter = writer
+            requests = [request(
+                'https://na1.salesforce.com/services/Soap/u/20.0', 'SID',
+                copy.deepcopy(sObjects)) for i in xrange(20)]
+            t0 = time()
+            for r in requests:
+                envelope = r.makeEnvelope()
+            print "\n%s, 200 record create: %.2f ms" % (
+                name, (time() - t0) * 1000 / len(requests))
+            envelopes.append(envelope)
+            if writer is self.soapWriter:
+                self.assertEqual(requests[0]._UpdateRequest__sObjects[0][
+                    'MailingAddress']['type'], 'Address')
+        self.assertEqual(envelopes[0], envelopes[1])
+
+    @benchmark
+    def testRetrieveEnvelope(self):
+        envelopes = []
+        for name, request in (('rendered', UncachedRetrieveRequest),
+                              ('cached', xmlclient.RetrieveRequest)):
+            t0 = time()
+            for i in xrange(2000):
+                envelope = request(
+                    'https://na1.salesforce.com/services/Soap/u/20.0',
+                    'SID', 'Id, Name', 'Account',
+                    ['001000000000%03dAAA' % (i % 1000)]).makeEnvelope()
+            print "\n%s headers, retrieve of 1 id: %.1f us" % (
+                name, (time() - t0) * 1e6 / 2000)
+            envelopes.append(envelope)
+        self.assertEqual(envelopes[0], envelopes[1])
+
+    @benchmark
+    def testPostRetries(self):
+        xmlclient.gzipRequest = True
+        sObjects = [dict(type='Contact', LastName='Doe %d' % i,
+                         FirstName='John', Email='john@doe.com')
+                    for i in xrange(200)]
+        url = 'https://na1.salesforce.com/services/Soap/u/20.0'
+        request = CountingCreateRequest(url, 'SID', sObjects)
+        FlakyConnection.failures = 2
+        FlakyConnection.bodies = []
+        t0 = time()
+        result = request.post(FlakyPool())
+        print "\n3 attempts, %d serialization: %.2f ms" % (
+            request.serialized, (time() - t0) * 1000)
+        self.assertEqual(str(result[_tPartnerNS.id]), '003000000000001AAA')
+        self.assertEqual(request.serialized, 1)
+        self.assertEqual(len(FlakyConnection.bodies), 3)
+        self.failUnless(FlakyConnection.bodies[0] is
+                        FlakyConnection.bodies[2])
+        # prepared on another thread, while e.g. an earlier batch is posted
+        executor = Executor(1)
+        request = CountingCreateRequest(url, 'SID', sObjects)
+        preparing = executor.submit(request.prepare)
+        request.post(FlakyPool())
+        self.failUnless(preparing.result().body is
+                        FlakyConnection.bodies[-1])
+        self.assertEqual(request.serialized, 1)
+        executor.shutdown()
+
 def test_suite():
     return unittest.TestSuite((
         unittest.makeSuite(TestUtils),
+        unittest.makeSuite(TestDecoding),
+        unittest.makeSuite(TestEncoding),
         ))
 
 if __name__ == '__main__':
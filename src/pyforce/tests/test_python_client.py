@@ -1,12 +1,23 @@
 from types import DictType, StringTypes, IntType, ListType, TupleType
 import unittest
 import datetime
+import copy
+import csv
+import os
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
 
 import sfconfig
 import pyforce
 
 from pyforce import SoapFaultError
-from pyforce.pyforce import _prepareSObjects
+from pyforce.pyforce import _prepareSObjects, CompactQueryRecord
+from pyforce.pyforce import LazyQueryRecord, LazyValue
+from pyforce import export
+from pyforce import marshall
+from pyforce.soql import dateBounds
 
 class TestUtils(unittest.TestCase):
 
@@ -19,11 +30,7 @@ class TestUtils(unittest.TestCase):
         svc = self.svc
         ids = self._todelete
         if ids:
-            while len(ids) > 200:
-                svc.delete(ids[:200])
-                ids = ids[200:]
-            if ids:
-                svc.delete(ids)
+            svc.delete(ids)
     
     def testDescribeGlobal(self):
         svc = self.svc
@@ -195,6 +202,62 @@ class TestUtils(unittest.TestCase):
         contacts = svc.retrieve(fieldnames, 'Contact', [id])
         self.assertEqual(len(contacts), 1)
     
+    def testAsyncRetrieve(self):
+        svc = self.svc
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(5)]
+        res = svc.create(data)
+        ids = [r['id'] for r in res]
+        self._todelete.extend(ids)
+        asvc = pyforce.AsyncClient(maxConcurrency=5)
+        asvc.useSession(svc.sessionId, svc._serverUrl)
+        futures = [asvc.retrieve('Id, FirstName', 'Contact', [id])
+                   for id in ids]
+        contacts = [f.result()[0] for f in futures]
+        asvc.close()
+        self.assertEqual([c['Id'] for c in contacts], ids)
+        self.assertEqual([c['FirstName'] for c in contacts],
+                         [d['FirstName'] for d in data])
+
+    def testRetrieveChunked(self):
+        svc = self.svc
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(5)]
+        res = svc.create(data)
+        ids = [r['id'] for r in res]
+        self._todelete.extend(ids)
+        ids.reverse()
+        limit = pyforce.pyforce.MAX_RETRIEVE_IDS
+        pyforce.pyforce.MAX_RETRIEVE_IDS = 2
+        try:
+            contacts = svc.retrieve('Id, FirstName', 'Contact', ids)
+        finally:
+            pyforce.pyforce.MAX_RETRIEVE_IDS = limit
+        # three calls, reassembled in the order of ids
+        self.assertEqual([c['Id'] for c in contacts], ids)
+        self.assertEqual([c['FirstName'] for c in contacts],
+                         ['John%d' % x for x in range(4, -1, -1)])
+
+    def testSaveInBatches(self):
+        svc = self.svc
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(450)]
+        # an unknown field faults the whole call, for its own batch only
+        data[300]['NoSuchField__c'] = 'x'
+        res = svc.create(data)
+        self.assertEqual(len(res), 450)
+        self._todelete.extend([r['id'] for r in res if r['success']])
+        self.assertEqual([r['success'] for r in res],
+                         [True] * 200 + [False] * 200 + [True] * 50)
+        self.failUnless(res[200]['errors'])
+        ids = [r['id'] for r in res if r['success']]
+        contacts = svc.retrieve('Id, FirstName', 'Contact', ids)
+        self.assertEqual([c['FirstName'] for c in contacts],
+                         ['John%d' % x for x in range(200) + range(400, 450)])
+        res = svc.delete(ids)
+        self.assertEqual([r['id'] for r in res], ids)
+        self._todelete = list()
+
     def testRetrieveDeleted(self):
         svc = self.svc
         data = dict(type='Contact',
@@ -214,6 +277,25 @@ class TestUtils(unittest.TestCase):
         fieldnames = ', '.join(fieldnames)
         contacts = svc.retrieve(fieldnames, 'Contact', [id])
         self.assertEqual(len(contacts), 0)
+
+    def testRetrieveMissing(self):
+        svc = self.svc
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(3)]
+        ids = [r['id'] for r in svc.create(data)]
+        self._todelete.extend([ids[0], ids[2]])
+        svc.delete(ids[1])
+        # ids that don't exist give None, the others still line up with ids
+        for saxDecoding in (False, True):
+            svc.saxDecoding = saxDecoding
+            try:
+                contacts = svc.retrieve('Id, FirstName', 'Contact', ids)
+            finally:
+                svc.saxDecoding = False
+            self.assertEqual(len(contacts), 3)
+            self.assertEqual(contacts[1], None)
+            self.assertEqual([contacts[0]['Id'], contacts[2]['Id']],
+                             [ids[0], ids[2]])
     
     def testDelete(self):
         svc = self.svc
@@ -417,6 +499,64 @@ class TestUtils(unittest.TestCase):
         # clean up
         self.svc.cacheTypeDescriptions = False
     
+    def testTypeDescriptionsCacheBounds(self):
+        svc = self.svc
+        svc.cacheTypeDescriptions = True
+        svc.typeDescs = pyforce.TypeDescriptionCache(maxEntries=1)
+        svc.query('SELECT Id FROM Contact LIMIT 1')
+        svc.query('SELECT Id FROM Contact LIMIT 1')
+        self.assertEqual((svc.typeDescs.hits, svc.typeDescs.misses), (1, 1))
+        # Account pushes Contact out
+        svc.query('SELECT Id FROM Account LIMIT 1')
+        self.assertEqual(len(svc.typeDescs), 1)
+        self.failIf('Contact' in svc.typeDescs)
+        svc.typeDescs.ttl = 0
+        svc.query('SELECT Id FROM Account LIMIT 1')
+        self.assertEqual(svc.typeDescs.misses, 3)
+        svc.cacheTypeDescriptions = False
+
+    def testDescribeCache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = pyforce.FileDescribeCache(directory)
+            calls = []
+            for i in range(2):  # a fresh client, as in a new process
+                svc = pyforce.PythonClient(describeCache=cache)
+                svc.login(sfconfig.USERNAME, sfconfig.PASSWORD)
+                describe = svc._describeSObjects
+                svc._describeSObjects = lambda types: (calls.append(types)
+                                                       or describe(types))
+                res = svc.describeSObjects(['Contact', 'Account'])
+                self.assertEqual([r.name for r in res], ['Contact', 'Account'])
+                svc.query('SELECT Id, LastName FROM Contact LIMIT 1')
+            # only described the first time round
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(sorted(calls[0]), ['Account', 'Contact'])
+        finally:
+            shutil.rmtree(directory)
+
+    def testMarshallPlans(self):
+        svc = pyforce.PythonClient(cacheTypeDescriptions=True)
+        svc.login(sfconfig.USERNAME, sfconfig.PASSWORD)
+        res = svc.query('SELECT Id, LastName, Birthdate FROM Contact LIMIT 5')
+        self.failUnless(len(res) > 0)
+        # one plan for all records of the same type and fields
+        self.assertEqual(len(svc.marshallPlans), 1)
+        [(typeDesc, plan)] = svc.marshallPlans.values()
+        svc.query('SELECT Id, LastName, Birthdate FROM Contact LIMIT 5')
+        self.failUnless(svc.marshallPlans.values()[0][1] is plan)
+        # refreshing the descriptions compiles a new plan
+        svc.flushTypeDescriptionsCache()
+        self.assertEqual(svc.marshallPlans, {})
+        res2 = svc.query('SELECT Id, LastName, Birthdate FROM Contact LIMIT 5')
+        self.failIf(svc.marshallPlans.values()[0][1] is plan)
+        self.assertEqual(res, res2)
+        # the least recently used plans are dropped past maxEntries
+        svc.marshallPlans.maxEntries = 1
+        svc.query('SELECT Id, Name FROM Account LIMIT 5')
+        self.assertEqual(len(svc.marshallPlans), 1)
+        self.assertEqual(svc.marshallPlans.keys()[0][0], 'Account')
+    
     def testChildToParentMultiQuery(self):
         svc = self.svc
         account_data = dict(type='Account',
@@ -589,6 +729,30 @@ class TestUtils(unittest.TestCase):
                 result += 1
         self.assertEqual(result, rr.Contacts.size)
     
+    def testSaxDecoding(self):
+        svc = self.svc
+        account = svc.create([dict(type='Account', Name='SaxTestAccount')])
+        self._todelete.append(account[0]['id'])
+        contact = svc.create([dict(type='Contact', LastName='Doe',
+                                   FirstName='John',
+                                   AccountId=account[0]['id'],
+                                   Birthdate=datetime.date(1970, 1, 4))])
+        self._todelete.append(contact[0]['id'])
+        query = ("select Id, Name, (select FirstName, Birthdate, Account.Name "
+                 "from Contacts) from Account where Name = 'SaxTestAccount'")
+        expected = svc.query(query)
+        svc.saxDecoding = True
+        try:
+            res = svc.query(query)
+            contacts = svc.retrieve('Id, FirstName, Birthdate', 'Contact',
+                                    [contact[0]['id']])
+        finally:
+            svc.saxDecoding = False
+        self.assertEqual(res.size, 1)
+        self.assertEqual(list(res), list(expected))
+        self.assertEqual(res[0].Contacts[0].Account.Name, 'SaxTestAccount')
+        self.assertEqual(contacts[0]['Birthdate'], datetime.date(1970, 1, 4))
+
     def testMultiQueryCount(self):
         svc = self.svc
         contact_data = dict(type='Contact',
@@ -668,6 +832,243 @@ class TestUtils(unittest.TestCase):
         self.failUnless(res['done'])
         self.assertEqual(len(res['records']), 50)
     
+    def testQueryIter(self):
+        svc = self.svc
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(250)]
+        res = svc.create(data)
+        self._todelete.extend([x['id'] for x in res])
+        soql = "SELECT FirstName FROM Contact WHERE LastName = 'Doe'"
+        for prefetch in (0, 1, 2):
+            names = [r.FirstName for r in svc.query_iter(soql, prefetch)]
+            self.assertEqual(sorted(names), sorted([d['FirstName']
+                                                    for d in data]))
+
+    def testQueryPartitioned(self):
+        svc = self.svc
+        svc.batchSize = 200
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(450)]
+        res = svc.create(data)
+        self._todelete.extend([x['id'] for x in res])
+        soql = "SELECT Id, FirstName FROM Contact WHERE LastName = 'Doe'"
+        for field in ('Id', 'CreatedDate'):
+            records = list(svc.query_partitioned(soql, 4, field))
+            self.assertEqual(sorted([r.Id for r in records]),
+                             sorted([x['id'] for x in res]))
+            self.assertEqual(sorted([r.FirstName for r in records]),
+                             sorted([d['FirstName'] for d in data]))
+
+    def testDateBounds(self):
+        self.assertEqual(dateBounds('2015-12-01', '2015-12-09', 4),
+                         ['2015-12-03', '2015-12-05', '2015-12-07'])
+        # bounds are whole seconds or days, none would split these ranges
+        self.assertEqual(dateBounds('2015-12-01T10:11:12.250Z',
+                                    '2015-12-01T10:11:12.750Z', 4), [])
+        self.assertEqual(dateBounds('2015-12-01', '2015-12-01', 4), [])
+        self.assertEqual(dateBounds('2015-12-01T10:11:12.250Z',
+                                    '2015-12-01T10:11:14.000Z', 4),
+                         ['2015-12-01T10:11:13.000Z'])
+
+    def testQueryColumnar(self):
+        svc = self.svc
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x,
+                     Birthdate=x % 2 and datetime.date(1970, 1, 1 + x) or None)
+                for x in range(20)]
+        res = svc.create(data)
+        self._todelete.extend([x['id'] for x in res])
+        soql = ("SELECT Id, FirstName, Birthdate, CreatedDate, "
+                "HasOptedOutOfEmail FROM Contact WHERE LastName = 'Doe'")
+        records = svc.query_columnar(soql)
+        self.assertEqual(len(records), 20)
+        self.assertEqual(records.names(), ['Id', 'FirstName', 'Birthdate',
+                                           'CreatedDate', 'HasOptedOutOfEmail'])
+        self.assertEqual(records['birthdate'].kind, 'date')
+        self.assertEqual(records['CreatedDate'].kind, 'datetime')
+        self.assertEqual(records['HasOptedOutOfEmail'].typecode, 'b')
+        expected = dict([(d['FirstName'], d['Birthdate']) for d in data])
+        for row in records.rows():
+            self.assertEqual(row['Birthdate'], expected[row['FirstName']])
+            self.assertEqual(type(row['CreatedDate']), datetime.datetime)
+
+    def testCompactRecords(self):
+        svc = self.svc
+        data = dict(type='Contact', LastName='Doe', FirstName='John',
+                    Birthdate=datetime.date(1970, 1, 4))
+        res = svc.create([data])
+        self._todelete.append(res[0]['id'])
+        soql = ("SELECT Id, LastName, Birthdate, Account.Name, "
+                "(SELECT Id FROM Notes) FROM Contact WHERE Id = '%s'"
+                % res[0]['id'])
+        expected = svc.query(soql)[0]
+        for saxDecoding in (False, True):
+            compact = pyforce.PythonClient(saxDecoding=saxDecoding,
+                                           compactRecords=True)
+            compact.useSession(svc.sessionId, svc._serverUrl)
+            record = compact.query(soql)[0]
+            self.failUnless(isinstance(record, CompactQueryRecord))
+            self.assertEqual(record, expected)
+            self.assertEqual(record.Birthdate, data['Birthdate'])
+            self.assertEqual(record['LastName'], 'Doe')
+            self.assertEqual(sorted(record.keys()), sorted(expected.keys()))
+            record.LastName = 'Smith'
+            self.assertEqual(record['LastName'], 'Smith')
+            self.assertRaises(KeyError, record.__setitem__, 'NoSuchField', 1)
+            self.assertEqual(copy.deepcopy(record), record)
+
+    def testLazyRecords(self):
+        svc = self.svc
+        data = dict(type='Contact', LastName='Doe', FirstName='John',
+                    Birthdate=datetime.date(1970, 1, 4))
+        res = svc.create([data])
+        self._todelete.append(res[0]['id'])
+        soql = ("SELECT Id, LastName, Birthdate, CreatedDate, Account.Name "
+                "FROM Contact WHERE Id = '%s'" % res[0]['id'])
+        expected = svc.query(soql)[0]
+        for saxDecoding in (False, True):
+            lazy = pyforce.PythonClient(saxDecoding=saxDecoding,
+                                        lazyRecords=True)
+            lazy.useSession(svc.sessionId, svc._serverUrl)
+            record = lazy.query(soql)[0]
+            self.failUnless(isinstance(record, LazyQueryRecord))
+            self.failUnless(isinstance(dict.get(record, 'Birthdate'),
+                                       LazyValue))
+            self.assertEqual(record.Birthdate, data['Birthdate'])
+            self.assertEqual(dict.get(record, 'Birthdate'), data['Birthdate'])
+            self.assertEqual(record, expected)
+            self.assertEqual(dict(lazy.query(soql)[0].decodeAll()), expected)
+
+    def testTimezoneAware(self):
+        svc = self.svc
+        res = svc.create([dict(type='Contact', LastName='Doe')])
+        self._todelete.append(res[0]['id'])
+        soql = "SELECT CreatedDate FROM Contact WHERE Id = '%s'" % res[0]['id']
+        naive = svc.query(soql)[0].CreatedDate
+        self.assertEqual(naive.tzinfo, None)
+        marshall.timezoneAware = True
+        try:
+            aware = svc.query(soql)[0].CreatedDate
+        finally:
+            marshall.timezoneAware = False
+        self.failUnless(aware.tzinfo is marshall.utc)
+        self.assertEqual(aware.replace(tzinfo=None), naive)
+        self.assertEqual(marshall.dateTimeConverter(
+            '2015-12-01T10:11:12.000-05:00'),
+            datetime.datetime(2015, 12, 1, 15, 11, 12))
+        # malformed values aren't parsed by slicing
+        self.assertEqual(marshall.dateTimeConverter(
+            '2015x12-01T10:11:12.000Z'), None)
+        self.assertEqual(marshall.dateTimeConverter(
+            '2015-12-01T10:11x12.000Z'), None)
+        self.assertEqual(marshall.dateConverter('2015-12x01'), None)
+
+    def testDescribingQuery(self):
+        svc = self.svc
+        account = svc.describeSObjects('Account')[0]
+        self.failUnless('Contact' in [r['childSObject'] for r in
+                                      account.ChildRelationships])
+        self.assertEqual(account.fields['ParentId'].relationshipName, 'Parent')
+        soql = "SELECT Id, Name FROM Account"
+        # nothing is described ahead unless descriptions are cached
+        self.assertEqual(svc._describingQuery(soql), None)
+        svc.cacheTypeDescriptions = True
+        svc.flushTypeDescriptionsCache()
+        try:
+            # nor for queries following relationships
+            self.assertEqual(svc._describingQuery(
+                "SELECT Id, Parent.Name FROM Account"), None)
+            self.assertEqual(svc._describingQuery(
+                "SELECT Id, (SELECT LastName FROM Contacts) FROM Account"),
+                None)
+            self.assertEqual(svc._describingQuery('not soql'), None)
+            describing = svc._describingQuery(soql)
+            self.assertEqual(describing.result().keys(), ['Account'])
+            # nor once the type is cached
+            self.assertEqual(svc._describingQuery(soql), None)
+        finally:
+            svc.cacheTypeDescriptions = False
+
+    def testQueryLazy(self):
+        svc = self.svc
+        svc.batchSize = 200
+        data = [dict(type='Contact', LastName='Doe', FirstName='John%d' % x)
+                for x in range(450)]
+        res = svc.create(data)
+        self._todelete.extend([x['id'] for x in res])
+        soql = "SELECT Id FROM Contact WHERE LastName = 'Doe' ORDER BY Id"
+        records = list(svc.query_iter(soql))
+        lazy = svc.query_lazy(soql, maxPages=1)
+        self.assertEqual(len(lazy), 450)
+        self.assertEqual(lazy['size'], 450)
+        # jumps straight to the last page, then back
+        self.assertEqual(lazy[-1], records[-1])
+        self.assertEqual(lazy[250:205:-3], records[250:205:-3])
+        self.assertEqual(list(lazy), records)
+        self.assertRaises(IndexError, lazy.__getitem__, 450)
+
+    def testExport(self):
+        svc = self.svc
+        data = dict(type='Contact', LastName='Doe', FirstName='Jo, "Jr"',
+                    Birthdate=datetime.date(1970, 1, 4))
+        res = svc.create([data])
+        self._todelete.append(res[0]['id'])
+        soql = ("SELECT Id, FirstName, Birthdate, Account.Name FROM Contact "
+                "WHERE Id = '%s'" % res[0]['id'])
+        out = StringIO()
+        self.assertEqual(export.export(svc, soql, out), 1)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows, [['Id', 'FirstName', 'Birthdate', 'Account.Name'],
+                                [res[0]['id'], 'Jo, "Jr"', '1970-01-04', '']])
+        out = StringIO()
+        export.export(svc, soql, out, 'jsonl')
+        self.assertEqual(json.loads(out.getvalue()),
+                         {'Id': res[0]['id'], 'FirstName': 'Jo, "Jr"',
+                          'Birthdate': '1970-01-04', 'Account.Name': None})
+        # the alias of the sObject type isn't part of the column names
+        out = StringIO()
+        export.export(svc, "SELECT c.Id, c.FirstName FROM Contact c "
+                      "WHERE c.Id = '%s'" % res[0]['id'], out)
+        self.assertEqual(out.getvalue().splitlines()[0], 'Id,FirstName')
+
+    def testExportAll(self):
+        svc = self.svc
+        res = svc.create([dict(type='Contact', LastName='Doe')])
+        self._todelete.append(res[0]['id'])
+        soql = "SELECT Id, LastName FROM Contact WHERE Id = '%s'" % res[0]['id']
+        directory = tempfile.mkdtemp()
+        try:
+            jobs = export.exportAll(svc, ['Account', soql, soql,
+                                          'SELECT Id FROM NoSuchObject__c'],
+                                    directory, 'jsonl', concurrency=2)
+            self.assertEqual([j.name for j in jobs],
+                             ['Account', 'Contact', 'Contact', 'NoSuchObject__c'])
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['Account.jsonl', 'Contact.jsonl',
+                              'Contact_2.jsonl', 'NoSuchObject__c.jsonl'])
+            self.assertEqual(jobs[0].error, None)
+            self.failUnless(jobs[0].soql.startswith('SELECT Id, '))
+            for job in jobs[1:3]:
+                self.assertEqual(job.error, None)
+                self.assertEqual(job.records, 1)
+                self.assertEqual(json.loads(open(job.path).read()),
+                                 {'Id': res[0]['id'], 'LastName': 'Doe'})
+            self.failUnless(isinstance(jobs[3].error, SoapFaultError))
+        finally:
+            shutil.rmtree(directory)
+
+    def testExportAllBadName(self):
+        directory = tempfile.mkdtemp()
+        try:
+            # a name that can't be described fails its own job only
+            jobs = export.exportAll(self.svc, ['NoSuchObject__c', 'Account'],
+                                    directory, 'jsonl')
+            self.failUnless(isinstance(jobs[0].error, SoapFaultError))
+            self.assertEqual(jobs[0].soql, None)
+            self.assertEqual(jobs[1].error, None)
+            self.assertEqual(os.listdir(directory), ['Account.jsonl'])
+        finally:
+            shutil.rmtree(directory)
+
     def testSearch(self):
         res = self.svc.search("FIND {barr} in ALL FIELDS RETURNING Contact(Id, Birthdate)")
         self.assertEqual(len(res), 1)
@@ -676,6 +1077,17 @@ class TestUtils(unittest.TestCase):
         
         res = self.svc.search("FIND {khgkshgsuhalsf} in ALL FIELDS RETURNING Contact(Id)")
         self.assertEqual(len(res), 0)
+
+        # every searchRecords entry is returned, whatever the decoding
+        sosl = "FIND {barr} in ALL FIELDS RETURNING Contact(Id), Account(Id), Lead(Id)"
+        res = self.svc.search(sosl)
+        self.svc.saxDecoding = True
+        try:
+            saxRes = self.svc.search(sosl)
+        finally:
+            self.svc.saxDecoding = False
+        self.failUnless(len(res) >= 1)
+        self.assertEqual(sorted(r.Id for r in res), sorted(r.Id for r in saxRes))
     
     def testGetDeleted(self):
         svc = self.svc
@@ -904,6 +1316,14 @@ class TestUtils(unittest.TestCase):
         with self.assertRaises(pyforce.SessionTimeoutError) as cm:
             self.svc.getUserInfo()
         self.assertEqual(cm.exception.faultCode, 'INVALID_SESSION_ID', "Session didn't fail with INVALID_SESSION_ID.")
+
+    def testClose(self):
+        with pyforce.PythonClient() as svc:
+            svc.login(sfconfig.USERNAME, sfconfig.PASSWORD)
+            self.assertEqual(len(svc.query("SELECT Id FROM Contact LIMIT 1")), 1)
+        self.failIf(svc.isConnected())
+        # the worker threads are gone
+        self.assertRaises(RuntimeError, svc._executor.submit, len, [])
         
 def test_suite():
     return unittest.TestSuite((
@@ -1,8 +1,10 @@
 import unittest
+import threading
 import pyforce
 import sfconfig
 import datetime
 partnerns = pyforce._tPartnerNS
+sobjectns = pyforce._tSObjectNS
 svc = pyforce.XMLClient()
 
 class TestBeatbox(unittest.TestCase):
@@ -95,6 +97,47 @@ class TestBeatbox(unittest.TestCase):
         self.assertEqual(
             janeid, str(records[0][pyforce._tSObjectNS.Id]))
 
+    def testSharedBetweenThreads(self):
+        query = "select Id from Contact limit 5"
+        expected = int(str(svc.query(query)[partnerns.size]))
+        sizes = []
+        def worker():
+            for i in range(3):
+                res = svc.query(query)
+                sizes.append(int(str(res[partnerns.size])))
+        threads = [threading.Thread(target=worker) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sizes, [expected] * 24)
+
+    def testStreamResponse(self):
+        query = "select Id, LastName from Contact limit 50"
+        expected = svc.query(query).__repr__(1)
+        pyforce.xmlclient.streamResponse = True
+        try:
+            self.assertEqual(svc.query(query).__repr__(1), expected)
+        finally:
+            pyforce.xmlclient.streamResponse = False
+
+    def testQueryIter(self):
+        query = "select Id from Contact"
+        res = svc.query(query)
+        records = [str(r[sobjectns.Id]) for r in svc.query_iter(query)]
+        self.assertEqual(len(records), int(str(res[partnerns.size])))
+        self.assertEqual(len(set(records)), len(records))
+
+    def testQueryPartitioned(self):
+        query = "select Id from Contact"
+        records = [str(r[sobjectns.Id]) for r in svc.query_iter(query)]
+        for partitions in (1, 3):
+            parts = [str(r[sobjectns.Id])
+                     for r in svc.query_partitioned(query, partitions)]
+            self.assertEqual(sorted(parts), sorted(records))
+        self.assertRaises(ValueError, list,
+                          svc.query_partitioned(query + " order by Id"))
+
     def testSearch(self):
         sosl = 'find {barr} in ALL FIELDS returning Contact(Id, LastName, FirstName, Phone, Email, Birthdate)'
         res = svc.search(sosl)
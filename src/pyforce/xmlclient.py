@@ -4,14 +4,21 @@ __copyright__ = "GNU GPL 2."
 
 import httplib
 import logging
+import re
+import select
 import socket
+import threading
+import time
+import zlib
 from urlparse import urlparse
 from StringIO import StringIO
 import gzip
 import datetime
 import xmltramp
 from xmltramp import islst
-from xml.sax.saxutils import XMLGenerator
+from executor import Executor, prefetched, merged
+from soql import clauses, addCondition, rangeConditions, dateBounds
+from soql import _dateValue
 from xml.sax.saxutils import quoteattr
 from xml.sax.xmlreader import AttributesNSImpl
 
@@ -33,32 +40,204 @@ _tSchemaInstanceNS = xmltramp.Namespace(_schemaInstanceNs)
 # global config
 gzipRequest = True    # are we going to gzip the request ?
 gzipResponse = True   # are we going to tell teh server to gzip the response ?
+streamResponse = False  # parse responses as they are read off the socket,
+                        # instead of buffering the whole body first
 forceHttp = False     # force all connections to be HTTP, for debugging
+poolSize = 4          # max connections per host held by a ConnectionPool
+poolIdleTimeout = 60  # seconds an idle pooled connection is kept around
+
+# query locators are a cursor id and the offset of the next record
+locatorregx = re.compile(r'^(.+)-(\d+)$')
 
 _logger = logging.getLogger('pyforce.{0}'.format(__name__))
 
 
-def makeConnection(scheme, host):
+def makeConnection(scheme, host, pool=None):
+    if pool is not None:
+        return pool.checkout(scheme, host)
     if forceHttp or scheme.upper() == 'HTTP':
         return httplib.HTTPConnection(host)
     return httplib.HTTPSConnection(host)
 
 
+def isReusable(conn):
+    """
+    Health check run before a pooled connection is handed out again.
+
+    An idle keep-alive socket should have nothing to read; if it is
+    readable the server has closed it (or sent something we did not ask
+    for), either way it cannot be used for the next request.
+    """
+    response = conn._HTTPConnection__response
+    if conn._HTTPConnection__state != 'Idle' or \
+            (response is not None and not response.isclosed()):
+        return False
+    if conn.sock is None:
+        # not connected yet, or closed by httplib after a 'Connection:
+        # close' response; httplib reconnects transparently.
+        return True
+    try:
+        readable = select.select([conn.sock], [], [], 0)[0]
+    except (select.error, socket.error, ValueError):
+        return False
+    return not readable
+
+
+class ConnectionPool(object):
+    """
+    A thread safe pool of keep-alive HTTP(S) connections.
+
+    Connections are keyed by (scheme, host). At most maxsize connections
+    per key are checked out at any time, further checkouts block until one
+    is checked back in. Idle connections are closed after idleTimeout
+    seconds, and every idle connection is health checked before reuse.
+    """
+    def __init__(self, maxsize=None, idleTimeout=None):
+        self.maxsize = maxsize or poolSize
+        if idleTimeout is None:
+            idleTimeout = poolIdleTimeout
+        self.idleTimeout = idleTimeout
+        self.__cond = threading.Condition()
+        self.__idle = {}   # key -> list of (lastUsed, conn), newest last
+        self.__busy = {}   # key -> number of checked out connections
+
+    def __key(self, scheme, host):
+        if forceHttp or scheme.upper() == 'HTTP':
+            return ('http', host)
+        return ('https', host)
+
+    def __evict(self, now):
+        for key, idle in self.__idle.items():
+            while idle and now - idle[0][0] > self.idleTimeout:
+                idle.pop(0)[1].close()
+
+    def checkout(self, scheme, host):
+        key = self.__key(scheme, host)
+        self.__cond.acquire()
+        try:
+            while True:
+                self.__evict(time.time())
+                idle = self.__idle.get(key, [])
+                while idle:
+                    conn = idle.pop()[1]
+                    if isReusable(conn):
+                        self.__busy[key] = self.__busy.get(key, 0) + 1
+                        return conn
+                    conn.close()
+                if self.__busy.get(key, 0) < self.maxsize:
+                    self.__busy[key] = self.__busy.get(key, 0) + 1
+                    break
+                self.__cond.wait()
+        finally:
+            self.__cond.release()
+        return makeConnection(*key)
+
+    def checkin(self, scheme, host, conn):
+        key = self.__key(scheme, host)
+        self.__cond.acquire()
+        try:
+            self.__busy[key] -= 1
+            self.__idle.setdefault(key, []).append((time.time(), conn))
+            self.__cond.notify()
+        finally:
+            self.__cond.release()
+
+    # give back a connection that failed, it is closed rather than reused
+    def discard(self, scheme, host, conn):
+        key = self.__key(scheme, host)
+        conn.close()
+        self.__cond.acquire()
+        try:
+            self.__busy[key] -= 1
+            self.__cond.notify()
+        finally:
+            self.__cond.release()
+
+    def idleCount(self, scheme, host):
+        self.__cond.acquire()
+        try:
+            self.__evict(time.time())
+            return len(self.__idle.get(self.__key(scheme, host), []))
+        finally:
+            self.__cond.release()
+
+    def close(self):
+        self.__cond.acquire()
+        try:
+            for idle in self.__idle.values():
+                for lastUsed, conn in idle:
+                    conn.close()
+            self.__idle = {}
+        finally:
+            self.__cond.release()
+
+
+class GzipStreamReader(object):
+    """
+    File like wrapper gunzipping a response as the parser reads it.
+
+    Only the current compressed block and its decompressed output are held
+    in memory, never the whole body.
+    """
+    def __init__(self, fileobj, blockSize=2 ** 16):
+        self.fileobj = fileobj
+        self.blockSize = blockSize
+        # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+        self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.__eof = False
+
+    def read(self, size=-1):
+        # the sax parser stops at the first empty read, so keep going until
+        # some output is produced or the stream really is exhausted
+        while not self.__eof:
+            chunk = self.fileobj.read(size > 0 and size or self.blockSize)
+            if not chunk:
+                self.__eof = True
+                return self.__decompressor.flush()
+            data = self.__decompressor.decompress(chunk)
+            if data:
+                return data
+        return ''
+
+    def close(self):
+        self.fileobj.close()
+
+
+def responseStream(response):
+    if response.getheader('content-encoding', '') == 'gzip':
+        return GzipStreamReader(response)
+    return response
+
+
 # the main sforce client proxy class
+# A Client can be shared between threads once logged in, each call checks a
+# connection out of the client's ConnectionPool for its duration.
 class Client(object):
-    def __init__(self, serverUrl=None):
+    def __init__(self, serverUrl=None, maxConnections=None):
         self.batchSize = 500
         self.serverUrl = serverUrl or DEFAULT_SERVER_URL
-        self.__conn = None
+        self._serverUrl = None  # of the session, set by useSession
+        self._pool = ConnectionPool(maxConnections)
+        # runs the requests of calls split into several concurrent ones
+        self._executor = Executor(self._pool.maxsize)
+
+    # closes the idle pooled connections and stops the worker threads, calls
+    # split into concurrent requests can't be made afterwards
+    def close(self):
+        self._pool.close()
+        self._executor.shutdown(wait=False)
 
-    def __del__(self):
-        if callable(getattr(self.__conn, 'close', None)):
-            self.__conn.close()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
 
     # login, the serverUrl and sessionId are automatically handled, returns the
     # loginResult structure
     def login(self, username, password):
-        lr = LoginRequest(self.serverUrl, username, password).post()
+        lr = LoginRequest(self.serverUrl, username, password).post(
+            self._pool)
         self.useSession(str(lr[_tPartnerNS.sessionId]), str(
             lr[_tPartnerNS.serverUrl])
         )
@@ -68,167 +247,272 @@ class Client(object):
     # launched via a custom link
     def useSession(self, sessionId, serverUrl):
         self.sessionId = sessionId
-        self.__serverUrl = serverUrl
-        (scheme, host, path, params, query, frag) = urlparse(self.__serverUrl)
-        self.__conn = makeConnection(scheme, host)
+        self._serverUrl = serverUrl
 
     def logout(self):
         return LogoutRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId
-        ).post(self.__conn)
+        ).post(self._pool)
 
     # set the batchSize property on the Client instance to change the batchsize
     # for query/queryMore
-    def query(self, soql):
+    # seeder, where given, is the xmltramp.Seeder used to parse the response
+    def query(self, soql, seeder=None):
         return QueryRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             self.batchSize,
             soql
-        ).post(self.__conn)
+        ).post(self._pool, seeder=seeder)
 
-    def queryMore(self, queryLocator):
+    def queryMore(self, queryLocator, seeder=None):
         return QueryMoreRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             self.batchSize,
             queryLocator
-        ).post(self.__conn)
+        ).post(self._pool, seeder=seeder)
 
-    def search(self, sosl):
+    def query_iter(self, soql, prefetch=1):
+        """
+        Yield the records matched by soql, one page at a time. While a page
+        is being consumed, up to prefetch of the next pages are requested
+        with queryMore on a background thread, 0 fetches them on demand.
+        """
+        pages = self.__queryPages(soql)
+        if prefetch > 0:
+            pages = prefetched(pages, prefetch)
+        for page in pages:
+            for record in self._pageRecords(page):
+                yield record
+
+    def __queryPages(self, soql):
+        page = self.query(soql)
+        while True:
+            yield page
+            queryLocator = self._nextPage(page)
+            if queryLocator is None:
+                return
+            page = self.queryMore(queryLocator)
+
+    def query_partitioned(self, soql, partitions=4, field='Id', prefetch=1):
+        """
+        Yield the records matched by soql like query_iter, in no particular
+        order, splitting the query into up to partitions slices of the
+        values of field, whose cursors are read in parallel.
+
+        field is Id, CreatedDate, SystemModstamp or another sortable field
+        that is never null. The slice bounds are field values at even
+        offsets of the records ordered by field, probed by moving the query
+        locator, or an even split of the time range of a date field when the
+        locator can't be moved. soql can't have GROUP BY, ORDER BY, LIMIT,
+        OFFSET or FOR clauses; a query fitting in one page isn't split.
+        Slices are disjoint, but records whose field changes while they are
+        read (like SystemModstamp) can be missed or repeated.
+        """
+        parts = clauses(soql)
+        for clause in ('group', 'order', 'limit', 'offset', 'for'):
+            if clause in parts:
+                raise ValueError('Can not partition a query with a %s '
+                                 'clause: %r' % (clause.upper(), soql))
+        bounds = []
+        if partitions > 1:
+            bounds = self.__partitionBounds(parts, partitions, field)
+        if bounds:
+            slices = [addCondition(soql, c)
+                      for c in rangeConditions(field, bounds)]
+        else:
+            slices = [soql]
+        _logger.debug('querying {0} slices of {1}'.format(len(slices), soql))
+        pages = merged([self.__queryPages(s) for s in slices],
+                       max(prefetch, 1))
+        for page in pages:
+            for record in self._pageRecords(page):
+                yield record
+
+    # the values of field splitting the records of a query into partitions
+    # slices of about the same size
+    def __partitionBounds(self, parts, partitions, field):
+        probe = 'SELECT %s FROM %s' % (field, parts['from'])
+        if 'where' in parts:
+            probe += ' WHERE ' + parts['where']
+        if 'with' in parts:
+            probe += ' WITH ' + parts['with']
+        page = QueryRequest(self._serverUrl, self.sessionId, self.batchSize,
+                            probe + ' ORDER BY %s' % field).post(self._pool)
+        records = page[_tPartnerNS.records:]
+        if str(page[_tPartnerNS.done]) == 'true':
+            return []
+        size = int(str(page[_tPartnerNS.size]))
+        match = locatorregx.match(str(page[_tPartnerNS.queryLocator]))
+        value = lambda record: str(record[getattr(_tSObjectNS, field)])
+        if match is None and _dateValue.match(value(records[0])):
+            # the locator can't be moved, split the time range evenly
+            last = QueryRequest(self._serverUrl, self.sessionId,
+                                self.batchSize,
+                                probe + ' ORDER BY %s DESC LIMIT 1' % field
+                                ).post(self._pool)[_tPartnerNS.records]
+            return dateBounds(value(records[0]), value(last), partitions)
+        bounds = []
+        for i in xrange(1, partitions):
+            offset = size * i // partitions
+            if offset < len(records):
+                bound = value(records[offset])
+            elif match is not None:
+                bound = value(QueryMoreRequest(
+                    self._serverUrl, self.sessionId, self.batchSize,
+                    '%s-%d' % (match.group(1), offset)
+                ).post(self._pool)[_tPartnerNS.records])
+            else:
+                break  # only the first page can be split
+            if not bounds or bound != bounds[-1]:
+                bounds.append(bound)
+        return bounds
+
+    # the records of a query or queryMore result, and the queryLocator of
+    # the next page if there is one
+    def _pageRecords(self, page):
+        return page[_tPartnerNS.records:]
+
+    def _nextPage(self, page):
+        if str(page[_tPartnerNS.done]) == 'true':
+            return None
+        return str(page[_tPartnerNS.queryLocator])
+
+    def search(self, sosl, seeder=None):
         return SearchRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             self.batchSize,
             sosl
-        ).post(self.__conn)
+        ).post(self._pool, seeder=seeder)
 
     def getUpdated(self, sObjectType, start, end):
         return GetUpdatedRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             sObjectType,
             start,
             end
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def getDeleted(self, sObjectType, start, end):
         return GetDeletedRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             sObjectType,
             start,
             end
-        ).post(self.__conn)
+        ).post(self._pool)
 
-    def retrieve(self, fields, sObjectType, ids):
+    def retrieve(self, fields, sObjectType, ids, seeder=None):
         return RetrieveRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             fields,
             sObjectType,
             ids
-        ).post(self.__conn)
+        ).post(self._pool, seeder=seeder)
 
     # sObjects can be 1 or a list, returns a single save result or a list
     def create(self, sObjects):
         return CreateRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             sObjects
-        ).post(self.__conn)
+        ).post(self._pool)
 
     # sObjects can be 1 or a list, returns a single save result or a list
     def update(self, sObjects):
         return UpdateRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             sObjects
-        ).post(self.__conn)
+        ).post(self._pool)
 
     # sObjects can be 1 or a list, returns a single upsert result or a list
     def upsert(self, externalIdName, sObjects):
         return UpsertRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             externalIdName,
             sObjects
-        ).post(self.__conn)
+        ).post(self._pool)
 
     # ids can be 1 or a list, returns a single delete result or a list
     def delete(self, ids):
         return DeleteRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             ids
-        ).post(self.__conn)
+        ).post(self._pool)
 
     # sObjectTypes can be 1 or a list, returns a single describe result or a
     # list of them
     def describeSObjects(self, sObjectTypes):
         return DescribeSObjectsRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             sObjectTypes
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def describeGlobal(self):
         return AuthenticatedRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             "describeGlobal"
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def describeLayout(self, sObjectType):
         return DescribeLayoutRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             sObjectType
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def describeTabs(self):
         return AuthenticatedRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             "describeTabs"
-        ).post(self.__conn, True)
+        ).post(self._pool, True)
 
     def getServerTimestamp(self):
         return str(AuthenticatedRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             "getServerTimestamp"
-        ).post(self.__conn)[_tPartnerNS.timestamp])
+        ).post(self._pool)[_tPartnerNS.timestamp])
 
     def resetPassword(self, userId):
         return ResetPasswordRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             userId
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def setPassword(self, userId, password):
         SetPasswordRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             userId,
             password
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def getUserInfo(self):
         return AuthenticatedRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             "getUserInfo"
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def convertLeads(self, convertLeads):
         return ConvertLeadsRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             convertLeads
-        ).post(self.__conn)
+        ).post(self._pool)
 
     def sendEmail(self, emails, massType='SingleEmailMessage'):
         """
@@ -247,74 +531,74 @@ class Client(object):
             this situation, sendEmail() will fail with NO_MASS_MAIL_PERMISSION.
         """
         return SendEmailRequest(
-            self.__serverUrl,
+            self._serverUrl,
             self.sessionId,
             emails,
             massType
-        ).post(self.__conn)
+        ).post(self._pool)
 
 
 # fixed version of XmlGenerator, handles unqualified attributes correctly
-class BeatBoxXmlGenerator(XMLGenerator):
-    def __init__(self, destination, encoding):
-        XMLGenerator.__init__(self, destination, encoding)
-
-        if hasattr(self, '_out') and self._out:
-            self._write = self._out.write
-            self._flush = self._out.flush
-
-    def makeName(self, name):
-        if name[0] is None:
-            #if the name was not namespace-scoped, use the qualified part
-            return name[1]
-        # else try to restore the original prefix from the namespace
-        return self._current_context[name[0]] + ":" + name[1]
-
-    def startElementNS(self, name, qname, attrs):
-        self._write(unicode('<' + self.makeName(name)))
-
-        for pair in self._undeclared_ns_maps:
-            self._write(unicode(' xmlns:%s="%s"' % pair))
-        self._undeclared_ns_maps = []
-
-        for (name, value) in attrs.items():
-            self._write(unicode(' %s=%s' % (
-                self.makeName(name),
-                quoteattr(value)))
-            )
-        self._write(unicode('>'))
-
-
-# General purpose xml writer.
-# Does a bunch of useful stuff above & beyond XmlGenerator
-# TODO: What does it do, beyond XMLGenerator?
-class XmlWriter(object):
+_escapes = re.compile(u'[&<>]')
+
+# (prefix, name) -> (start tag, end tag) of elements without attributes
+_tags = {}
+
+
+# General purpose xml writer: the document is collected as a list of
+# unicode strings, with the tags of elements without attributes precomputed,
+# then joined and encoded once. writeElement writes lists as repeated
+# elements and dicts as embedded elements, their type first, and leaves the
+# dicts unchanged.
+class BufferedXmlWriter(object):
     def __init__(self, doGzip):
-        self.__buf = StringIO("")
-        if doGzip:
-            self.__gzip = gzip.GzipFile(mode='wb', fileobj=self.__buf)
-            stm = self.__gzip
-        else:
-            stm = self.__buf
-            self.__gzip = None
-        self.xg = BeatBoxXmlGenerator(stm, "utf-8")
-        self.xg.startDocument()
-        self.__elems = []
+        self.__doGzip = doGzip
+        self.__out = [u'<?xml version="1.0" encoding="utf-8"?>\n']
+        self.__contexts = []
+        self.__prefixes = {}  # namespace -> prefix
+        self.__undeclared = []  # (prefix, namespace) to declare
+        self.__elems = []  # end tags of the open elements
 
     def startPrefixMapping(self, prefix, namespace):
-        self.xg.startPrefixMapping(prefix, namespace)
+        self.__contexts.append(self.__prefixes.copy())
+        self.__prefixes[namespace] = prefix
+        self.__undeclared.append((prefix, namespace))
 
     def endPrefixMapping(self, prefix):
-        self.xg.endPrefixMapping(prefix)
+        self.__prefixes = self.__contexts.pop()
+
+    def __tag(self, namespace, name):
+        prefix = None
+        if namespace is not None:
+            prefix = self.__prefixes[namespace]
+        tag = _tags.get((prefix, name))
+        if tag is None:
+            qname = name
+            if prefix is not None:
+                qname = prefix + ':' + name
+            qname = unicode(qname)
+            tag = _tags[(prefix, name)] = (u'<%s>' % qname, u'</%s>' % qname)
+        return tag
+
+    # the start tag of an element with attributes or namespace declarations
+    def __startTag(self, namespace, name, attrs):
+        out = [self.__tag(namespace, name)[0][:-1]]
+        for pair in self.__undeclared:
+            out.append(unicode(' xmlns:%s="%s"' % pair))
+        self.__undeclared = []
+        for (qname, value) in attrs.items():
+            out.append(unicode(' %s=%s' % (
+                self.__tag(qname[0], qname[1])[0][1:-1], quoteattr(value))))
+        out.append(u'>')
+        return u''.join(out)
 
     def startElement(self, namespace, name, attrs=_noAttrs):
-        self.xg.startElementNS((namespace, name), name, attrs)
-        self.__elems.append((namespace, name))
+        start, end = self.__tag(namespace, name)
+        if attrs or self.__undeclared:
+            start = self.__startTag(namespace, name, attrs)
+        self.__out.append(start)
+        self.__elems.append(end)
 
-    # General Function for writing an XML Element.
-    # Detects the type of the element, and handles each type appropriately.
-    # i.e. If a list, then it encodes each element, if a dict, it writes an
-    # embedded element.
     def writeElement(self, namespace, name, value, attrs=_noAttrs):
         if islst(value):
             for v in value:
@@ -323,35 +607,57 @@ class XmlWriter(object):
             self.startElement(namespace, name, attrs)
             if 'type' in value:
                 # Type must always come first, even in embedded objects.
-                type_entry = value['type']
-                self.writeElement(namespace, 'type', type_entry, attrs)
-                del value['type']
+                self.writeElement(namespace, 'type', value['type'], attrs)
             for k, v in value.items():
-                self.writeElement(namespace, k, v, attrs)
+                if k != 'type':
+                    self.writeElement(namespace, k, v, attrs)
             self.endElement()
-        else:
+        elif attrs or self.__undeclared:
             self.startElement(namespace, name, attrs)
             self.characters(value)
             self.endElement()
+        else:
+            start, end = self.__tag(namespace, name)
+            out = self.__out
+            out.append(start)
+            self.characters(value)
+            out.append(end)
 
     def endElement(self):
-        e = self.__elems[-1]
-        self.xg.endElementNS(e, e[1])
-        del self.__elems[-1]
+        self.__out.append(self.__elems.pop())
+
+    # what has been written from position on, as text that writeRaw can
+    # write again where the same prefixes are mapped
+    def position(self):
+        return len(self.__out)
+
+    def writtenSince(self, position):
+        return u''.join(self.__out[position:])
+
+    def writeRaw(self, text):
+        self.__out.append(text)
 
     def characters(self, s):
-        # todo base64 ?
         if isinstance(s, datetime.datetime) or isinstance(s, datetime.date):
             s = s.isoformat()
         elif isinstance(s, (int, float, long)):
             s = str(s)
-        self.xg.characters(s)
+        if not isinstance(s, unicode):
+            s = unicode(s, 'utf-8')
+        if _escapes.search(s) is not None:
+            s = s.replace(u'&', u'&amp;').replace(u'>', u'&gt;').replace(
+                u'<', u'&lt;')
+        self.__out.append(s)
 
     def endDocument(self):
-        self.xg.endDocument()
-        if (self.__gzip != None):
-            self.__gzip.close()
-        return self.__buf.getvalue()
+        data = u''.join(self.__out).encode('utf-8')
+        if not self.__doGzip:
+            return data
+        buf = StringIO()
+        f = gzip.GzipFile(mode='wb', fileobj=buf)
+        f.write(data)
+        f.close()
+        return buf.getvalue()
 
 
 # exception class for soap faults
@@ -378,10 +684,10 @@ class SessionTimeoutError(Exception):
         return repr(self.faultCode) + " " + repr(self.faultString)
 
 
-# soap specific stuff ontop of XmlWriter
-class SoapWriter(XmlWriter):
+# soap specific stuff ontop of BufferedXmlWriter
+class SoapWriter(BufferedXmlWriter):
     def __init__(self):
-        XmlWriter.__init__(self, gzipRequest)
+        BufferedXmlWriter.__init__(self, gzipRequest)
         self.startPrefixMapping("s", _envNs)
         self.startPrefixMapping("p", _partnerNs)
         self.startPrefixMapping("o", _sobjectNs)
@@ -394,7 +700,32 @@ class SoapWriter(XmlWriter):
         self.endPrefixMapping("o")
         self.endPrefixMapping("p")
         self.endPrefixMapping("s")
-        return XmlWriter.endDocument(self)
+        return BufferedXmlWriter.endDocument(self)
+
+
+# rendered <s:Header> elements by SoapEnvelope.headerKey, cleared when it
+# reaches MAX_RENDERED_HEADERS entries
+_renderedHeaders = {}
+MAX_RENDERED_HEADERS = 256
+
+
+class PreparedRequest(object):
+    """
+    The HTTP request of a SoapEnvelope, serialized and, with gzipRequest,
+    compressed once: post sends the same body and headers on every attempt.
+    """
+    def __init__(self, envelope):
+        self.body = envelope.makeEnvelope()
+        self.headers = {
+            "User-Agent": "Pyforce/{0}".format(__version__),
+            "SOAPAction": '""',
+            "Content-Type": "text/xml; charset=utf-8"
+        }
+        if gzipResponse:
+            self.headers['accept-encoding'] = 'gzip'
+        if gzipRequest:
+            self.headers['content-encoding'] = 'gzip'
+        (self.scheme, self.host, self.path) = urlparse(envelope.serverUrl)[:3]
 
 
 # processing for a single soap request / response
@@ -404,6 +735,23 @@ class SoapEnvelope(object):
         self.serverUrl = serverUrl
         self.operationName = operationName
         self.clientId = clientId
+        self.__prepared = None
+        self.__preparing = threading.Lock()
+
+    def prepare(self):
+        """
+        The PreparedRequest of this envelope, made by the first call. It
+        can be called ahead of post, e.g. on another thread while an earlier
+        request is in flight; post then uses it instead of serializing the
+        request itself.
+        """
+        self.__preparing.acquire()
+        try:
+            if self.__prepared is None:
+                self.__prepared = PreparedRequest(self)
+            return self.__prepared
+        finally:
+            self.__preparing.release()
 
     def writeHeaders(self, writer):
         pass
@@ -411,16 +759,36 @@ class SoapEnvelope(object):
     def writeBody(self, writer):
         pass
 
+    def headerKey(self):
+        """
+        The key of the rendered headers of this request in a cache, made of
+        everything they depend on, or None to render them every time.
+        Subclasses writing headers from anything else extend it.
+        """
+        return (self.__class__, self.clientId)
+
     def makeEnvelope(self):
         s = SoapWriter()
-        s.startElement(_envNs, "Header")
-        s.characters("\n")
-        s.startElement(_partnerNs, "CallOptions")
-        s.writeElement(_partnerNs, "client", self.clientId)
-        s.endElement()
-        s.characters("\n")
-        self.writeHeaders(s)
-        s.endElement()  # Header
+        key = self.headerKey()
+        header = None
+        if key is not None:
+            header = _renderedHeaders.get(key)
+            start = s.position()
+        if header is not None:
+            s.writeRaw(header)
+        else:
+            s.startElement(_envNs, "Header")
+            s.characters("\n")
+            s.startElement(_partnerNs, "CallOptions")
+            s.writeElement(_partnerNs, "client", self.clientId)
+            s.endElement()
+            s.characters("\n")
+            self.writeHeaders(s)
+            s.endElement()  # Header
+            if key is not None:
+                if len(_renderedHeaders) >= MAX_RENDERED_HEADERS:
+                    _renderedHeaders.clear()
+                _renderedHeaders[key] = s.writtenSince(start)
         s.startElement(_envNs, "Body")
         s.characters("\n")
         s.startElement(_partnerNs, self.operationName)
@@ -430,49 +798,68 @@ class SoapEnvelope(object):
         return s.endDocument()
 
     # does all the grunt work:
-    # * serializes the request
-    # * makes a http request
-    # * passes the response to tramp
+    # * serializes the request, once for all attempts, unless it has been
+    #   prepared already
+    # * makes a http request, conn may be a connection, a ConnectionPool or
+    #   None for a one-off connection
+    # * passes the response to tramp, straight off the socket if
+    #   streamResponse is set
     # * checks for soap fault
     #  returns the relevant result from the body child
     # TODO: check for mU='1' headers
-    def post(self, conn=None, alwaysReturnList=False):
-        headers = {
-            "User-Agent": "Pyforce/{0}".format(__version__),
-            "SOAPAction": '""',
-            "Content-Type": "text/xml; charset=utf-8"
-        }
-        if gzipResponse:
-            headers['accept-encoding'] = 'gzip'
-        if gzipRequest:
-            headers['content-encoding'] = 'gzip'
+    def post(self, conn=None, alwaysReturnList=False, seeder=None):
+        prepared = self.prepare()
         close = False
-        (scheme, host, path, params, query, frag) = urlparse(self.serverUrl)
+        pool = None
+        if isinstance(conn, ConnectionPool):
+            pool, conn = conn, None
+        scheme, host = prepared.scheme, prepared.host
         max_attempts = 3
         response = None
+        tramp = None
         attempt = 1
         while not response and attempt <= max_attempts:
             try:
                 if conn is None:
-                    conn = makeConnection(scheme, host)
-                    close = True
-                conn.request("POST", path, self.makeEnvelope(), headers)
+                    conn = makeConnection(scheme, host, pool)
+                    close = pool is None
+                conn.request("POST", prepared.path, prepared.body,
+                             prepared.headers)
                 response = conn.getresponse()
-                rawResponse = response.read()
+                if streamResponse:
+                    tramp = xmltramp.seed(responseStream(response), seeder)
+                else:
+                    rawResponse = response.read()
             except (httplib.HTTPException, socket.error):
                 if conn is not None:
-                    conn.close()
+                    if pool is not None:
+                        pool.discard(scheme, host, conn)
+                    else:
+                        conn.close()
                     conn = None
                     response = None
                 attempt += 1
+            except Exception:
+                # e.g. a malformed streamed response, the socket is in an
+                # unknown state so don't let it be reused
+                if conn is not None:
+                    if pool is not None:
+                        pool.discard(scheme, host, conn)
+                    else:
+                        conn.close()
+                raise
         if not response:
             raise RuntimeError('No response from Salesforce')
 
-        if response.getheader('content-encoding', '') == 'gzip':
+        if tramp is None and \
+                response.getheader('content-encoding', '') == 'gzip':
             rawResponse = gzip.GzipFile(fileobj=StringIO(rawResponse)).read()
         if close:
             conn.close()
-        tramp = xmltramp.parse(rawResponse)
+        elif pool is not None:
+            pool.checkin(scheme, host, conn)
+        if tramp is None:
+            tramp = xmltramp.parse(rawResponse, seeder)
         try:
             faultString = str(tramp[_tSoapNS.Body][_tSoapNS.Fault].faultstring)
             faultCode = str(
@@ -517,6 +904,9 @@ class AuthenticatedRequest(SoapEnvelope):
         s.writeElement(_partnerNs, "sessionId", self.sessionId)
         s.endElement()
 
+    def headerKey(self):
+        return SoapEnvelope.headerKey(self) + (self.sessionId,)
+
     def writeSObjects(self, s, sObjects, elemName="sObjects"):
         if islst(sObjects):
             for o in sObjects:
@@ -548,6 +938,9 @@ class QueryOptionsRequest(AuthenticatedRequest):
         s.writeElement(_partnerNs, "batchSize", self.batchSize)
         s.endElement()
 
+    def headerKey(self):
+        return AuthenticatedRequest.headerKey(self) + (self.batchSize,)
+
 
 class QueryRequest(QueryOptionsRequest):
     def __init__(self, serverUrl, sessionId, batchSize, soql):
@@ -24,6 +24,9 @@ empty = {
     ]
 }
 
+# elements with fewer children are always scanned, never indexed
+INDEX_MIN_CHILDREN = 32
+
 
 def quote(x, elt=True):
     if elt and '<' in x and len(x) > 24 and x.find(']]>') == -1:
@@ -53,6 +56,8 @@ class Element:
         self._name = name
         self._attrs = attrs or {}
         self._dir = children or []
+        self._index = None
+        self._scanned = 0
 
         prefixes = prefixes or {}
         self._prefixes = dict(zip(prefixes.values(), prefixes.keys()))
@@ -136,14 +141,45 @@ class Element:
         return out
 
     def __unicode__(self):
-        text = ''
-        for x in self._dir:
-            text += unicode(x)
+        text = u''.join([unicode(x) for x in self._dir])
         return ' '.join(text.split())
 
     def __str__(self):
         return self.__unicode__().encode('utf-8')
 
+    # child elements named n, or only the first of them. Children are
+    # scanned, stopping at the first match when that is all that's wanted.
+    # Once the scans of an element with many children have walked past more
+    # children than it has, a name -> children index is built instead, and
+    # rebuilt when children are added or removed.
+    def _children(self, n, first=False):
+        dir = self._dir
+        index = self._index
+        if index is None or index[0] != len(dir):
+            if self._scanned <= len(dir) or len(dir) < INDEX_MIN_CHILDREN:
+                found = []
+                scanned = len(dir)
+                for i, x in enumerate(dir):
+                    if isinstance(x, Element) and x._name == n:
+                        found.append(x)
+                        if first:
+                            scanned = i + 1
+                            break
+                self._scanned += scanned
+                return found
+            names = {}
+            for x in dir:
+                if isinstance(x, Element):
+                    if x._name in names:
+                        names[x._name].append(x)
+                    else:
+                        names[x._name] = [x]
+            index = self._index = (len(dir), names)
+        try:
+            return index[1].get(n, ())
+        except TypeError:  # unhashable name
+            return ()
+
     def __getattr__(self, n):
         if n[0] == '_':
             raise AttributeError(
@@ -151,16 +187,13 @@ class Element:
             )
         if self._dNS:
             n = (self._dNS, n)
-        for x in self._dir:
-            if isinstance(x, Element) and x._name == n:
-                return x
+        children = self._children(n, True)
+        if children:
+            return children[0]
         raise AttributeError('No child element named %s' % repr(n))
 
     def __hasattr__(self, n):
-        for x in self._dir:
-            if isinstance(x, Element) and x._name == n:
-                return True
-        return False
+        return len(self._children(n, True)) > 0
 
     def __setattr__(self, n, v):
         if n[0] == '_':
@@ -180,20 +213,17 @@ class Element:
             n = n.start
             if self._dNS and not islst(n):
                 n = (self._dNS, n)
-            out = []
-            for x in self._dir:
-                if isinstance(x, Element) and x._name == n:
-                    out.append(x)
-            return out
+            return list(self._children(n))
         else:  # d['foo'] == first <foo>
             if self._dNS and not islst(n):
                 n = (self._dNS, n)
-            for x in self._dir:
-                if isinstance(x, Element) and x._name == n:
-                    return x
+            children = self._children(n, True)
+            if children:
+                return children[0]
             raise KeyError(n)
 
     def __setitem__(self, n, v):
+        self._index = None
         if isinstance(n, type(0)):  # d[1]
             self._dir[n] = v
         elif isinstance(n, slice(0).__class__):
@@ -227,6 +257,7 @@ class Element:
                 del self[i]
 
     def __delitem__(self, n):
+        self._index = None
         if isinstance(n, type(0)):
             del self._dir[n]
         elif isinstance(n, slice(0).__class__):
@@ -278,7 +309,7 @@ from xml.sax.handler import EntityResolver, DTDHandler, ContentHandler,\
 class Seeder(EntityResolver, DTDHandler, ContentHandler, ErrorHandler):
     def __init__(self):
         self.stack = []
-        self.ch = ''
+        self.ch = []  # chunks of pending character data
         self.prefixes = {}
         ContentHandler.__init__(self)
 
@@ -293,12 +324,19 @@ class Seeder(EntityResolver, DTDHandler, ContentHandler, ErrorHandler):
         if len(self.prefixes[prefix]) == 0:
             del self.prefixes[prefix]
 
-    def startElementNS(self, name, qname, attrs):
-        ch = self.ch
-        self.ch = ''
+    # move pending character data into the element being built, dropping
+    # whitespace between elements
+    def flushCharacters(self):
+        if not self.ch:
+            return
+        ch = ''.join(self.ch)
+        self.ch = []
         if ch and not ch.isspace():
             self.stack[-1]._dir.append(ch)
 
+    def startElementNS(self, name, qname, attrs):
+        self.flushCharacters()
+
         attrs = dict(attrs)
         newprefixes = {}
         for k in self.prefixes.keys():
@@ -306,14 +344,12 @@ class Seeder(EntityResolver, DTDHandler, ContentHandler, ErrorHandler):
 
         self.stack.append(Element(name, attrs, prefixes=newprefixes.copy()))
 
+    # long texts come in many chunks, joined once they are complete
     def characters(self, ch):
-        self.ch += ch
+        self.ch.append(ch)
 
     def endElementNS(self, name, qname):
-        ch = self.ch
-        self.ch = ''
-        if ch and not ch.isspace():
-            self.stack[-1]._dir.append(ch)
+        self.flushCharacters()
 
         element = self.stack.pop()
         if self.stack:
@@ -325,8 +361,9 @@ from xml.sax import make_parser
 from xml.sax.handler import feature_namespaces
 
 
-def seed(fileobj):
-    seeder = Seeder()
+# seeder can be a Seeder subclass that handles parts of the document itself
+def seed(fileobj, seeder=None):
+    seeder = seeder or Seeder()
     parser = make_parser()
     parser.setFeature(feature_namespaces, 1)
     parser.setContentHandler(seeder)
@@ -334,9 +371,9 @@ def seed(fileobj):
     return seeder.result
 
 
-def parse(text):
+def parse(text, seeder=None):
     from StringIO import StringIO
-    return seed(StringIO(text))
+    return seed(StringIO(text), seeder)
 
 
 def load(url):